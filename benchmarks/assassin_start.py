@@ -0,0 +1,84 @@
+"""
+Times Assassin.start against a temporary SQLite file for a range of
+player counts.
+
+	python benchmarks/assassin_start.py --players 10 100 1000 5000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+import peewee
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from nerfzari.game import MODELS, User, GameMeta, PlayerMeta, UserStats, AssassinPlayer
+
+
+def populate(players):
+	"""Creates an Assassin game with the given number of players."""
+	creator = User.new_user('creator', 'Creator', 'creator@example.com')
+	meta = GameMeta.new_game(datetime.now(), 'assassin', 'bench', creator)
+	users = [uuid.uuid4() for _ in range(players)]
+	pmetas = [uuid.uuid4() for _ in range(players)]
+	tags = PlayerMeta.allocate_tags(players)
+	rows = {
+		User: [{
+			'primary_key': x,
+			'user_name': 'player{}'.format(idx),
+			'real_name': 'Player',
+			'email': 'player@example.com'
+		} for idx, x in enumerate(users)],
+		PlayerMeta: [{
+			'primary_key': pmetas[idx],
+			'user': users[idx],
+			'game': meta.primary_key,
+			'tag': tags[idx]
+		} for idx in range(players)],
+		AssassinPlayer: [{
+			'primary_key': uuid.uuid4(),
+			'meta': x
+		} for x in pmetas]
+	}
+	with User._meta.database.atomic():
+		for model in [User, PlayerMeta, AssassinPlayer]:
+			for batch in peewee.chunked(rows[model], 200):
+				model.insert_many(batch).execute()
+		# the raw inserts skip the counters new_player keeps
+		GameMeta.recount_alive()
+		UserStats.rebuild()
+	return GameMeta.get_by_id(meta.primary_key)
+
+
+def time_start(players, repeat):
+	"""
+	:returns: The best of repeat runs of Assassin.start, in seconds.
+	"""
+	best = None
+	for _ in range(repeat):
+		with tempfile.TemporaryDirectory() as tmp:
+			db = peewee.SqliteDatabase(os.path.join(tmp, 'bench.sqlite'))
+			with db.bind_ctx(MODELS):
+				db.create_tables(MODELS)
+				game = populate(players).game
+				start = time.perf_counter()
+				game.start()
+				elapsed = time.perf_counter() - start
+			db.close()
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--players', type=int, nargs='+', default=[10, 100, 1000, 5000])
+	parser.add_argument('--repeat', type=int, default=3)
+	args = parser.parse_args()
+	print('{:>8}  {:>10}  {:>12}'.format('players', 'start ms', 'us / player'))
+	for count in args.players:
+		elapsed = time_start(count, args.repeat)
+		print('{:>8}  {:>10.2f}  {:>12.1f}'.format(count, elapsed * 1000, elapsed * 1e6 / count))
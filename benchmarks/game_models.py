@@ -0,0 +1,161 @@
+"""
+Times the game model hot paths against a temporary SQLite file for a range
+of player counts, and writes the results as JSON to compare releases.
+
+	python benchmarks/game_models.py --players 10 100 1000 10000 --json new.json
+	python benchmarks/game_models.py --compare old.json
+
+Each player count gets a fresh database holding one Assassin game with
+that many players and a tenth as many other games. Times are seconds per
+call: the best and the median of the repeats.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime
+import peewee
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from nerfzari.game import MODELS, User, GameMeta, PlayerMeta, connect_db
+from nerfzari.game.models import UUIDModel, all_subclasses
+from nerfzari.game.username import generate_username
+from assassin_start import populate
+
+WRITES = 50 # new players and eliminations timed per player count
+
+
+def per_call(func, number, repeat):
+	""":returns: The seconds per call of each of repeat runs of number calls."""
+	return [x / number for x in timeit.Timer(func).repeat(repeat, number)]
+
+
+def each_call(funcs):
+	""":returns: The seconds each of funcs took, for calls that change state."""
+	times = []
+	for func in funcs:
+		start = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - start)
+	return times
+
+
+def model_cases(players, repeat):
+	"""
+	Runs the database cases on a fresh game of players.
+
+	:returns: A list of (case, times).
+	"""
+	rng = random.Random(players)
+	meta = populate(players)
+	game = meta.game
+	creator = meta.creator
+	for idx in range(players // 10):
+		GameMeta.new_game(datetime.now(), 'assassin', 'other{}'.format(idx), creator)
+	users = list(User.select().where(User.user_name != 'creator'))
+	sample = [rng.choice(users) for _ in range(100)]
+	picks = iter(sample * repeat * 10)
+	ret = []
+	ret.append(('Assassin.start', per_call(game.start, 1, repeat)))
+	ret.append(('Assassin.target', per_call(lambda: game.target(next(picks)), 100, repeat)))
+	ret.append(('User.kills', per_call(lambda: next(picks).kills(), 100, repeat)))
+	ret.append(('User.deaths', per_call(lambda: next(picks).deaths(), 100, repeat)))
+	ret.append(('GameMeta.list_games', per_call(lambda: list(GameMeta.list_games()), 10, repeat)))
+	# state changing cases run once per call, last
+	joining = [User.new_user('late{}'.format(x), 'Late', 'late@example.com') for x in range(WRITES)]
+	ret.append(('PlayerMeta.new_player', each_call(
+		[lambda x=x: PlayerMeta.new_player(x, meta) for x in joining]
+	)))
+	hunter = users[0]
+	reports = []
+	for _ in range(min(WRITES, players - 2)):
+		target = game.target(hunter)
+		tag = PlayerMeta.get(user=target, game=meta).tag
+		reports.append(each_call([lambda: game.eliminate_by_tag(hunter, tag)])[0])
+	ret.append(('GameBase.eliminate_by_tag', reports))
+	return ret
+
+
+def run(counts, repeat):
+	"""
+	:returns: The results, one dict per case and player count.
+	"""
+	results = []
+	add = lambda case, count, times: results.append({
+		'case': case,
+		'players': count,
+		'samples': len(times),
+		'best': min(times),
+		'median': statistics.median(times)
+	})
+	generate_username() # untimed, the first call loads the word lists
+	add('generate_username', None, per_call(generate_username, 1000, repeat))
+	add('all_subclasses', None, per_call(lambda: all_subclasses(UUIDModel), 1000, repeat))
+	for count in counts:
+		with tempfile.TemporaryDirectory() as tmp:
+			db = connect_db(os.path.join(tmp, 'bench.sqlite'))
+			with db.bind_ctx(MODELS):
+				db.create_tables(MODELS)
+				for case, times in model_cases(count, repeat):
+					add(case, count, times)
+			db.close()
+	return results
+
+
+def compare(old, new, threshold):
+	"""
+	Prints each case's median against the old run's.
+
+	:returns: The number of cases slower than threshold times the old median.
+	"""
+	before = { (x['case'], x['players']): x for x in old['results'] }
+	slower = 0
+	print('{:>26}  {:>7}  {:>11}  {:>11}  {:>7}'.format('case', 'players', 'old us', 'new us', 'ratio'))
+	for res in new['results']:
+		prev = before.get((res['case'], res['players']))
+		if prev is None:
+			continue
+		ratio = res['median'] / prev['median']
+		flag = ''
+		if ratio > threshold:
+			slower += 1
+			flag = '  slower'
+		print('{:>26}  {:>7}  {:>11.1f}  {:>11.1f}  {:>7.2f}{}'.format(
+			res['case'], res['players'] or '-', prev['median'] * 1e6, res['median'] * 1e6, ratio, flag))
+	return slower
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--players', type=int, nargs='+', default=[10, 100, 1000, 10000])
+	parser.add_argument('--repeat', type=int, default=5)
+	parser.add_argument('--json', help='write the results to this file')
+	parser.add_argument('--compare', help='a results file from an earlier run to compare against')
+	parser.add_argument('--threshold', type=float, default=1.5, help='the median ratio counted as a regression')
+	args = parser.parse_args()
+	report = {
+		'python': platform.python_version(),
+		'peewee': peewee.__version__,
+		'sqlite': sqlite3.sqlite_version,
+		'date': datetime.now().isoformat(),
+		'repeat': args.repeat,
+		'results': run(args.players, args.repeat)
+	}
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump(report, f, indent=2)
+	if args.compare:
+		with open(args.compare) as f:
+			sys.exit(1 if compare(json.load(f), report, args.threshold) else 0)
+	print('{:>26}  {:>7}  {:>6}  {:>11}  {:>11}'.format('case', 'players', 'samples', 'best us', 'median us'))
+	for res in report['results']:
+		print('{:>26}  {:>7}  {:>6}  {:>11.1f}  {:>11.1f}'.format(
+			res['case'], res['players'] or '-', res['samples'], res['best'] * 1e6, res['median'] * 1e6))
@@ -0,0 +1,215 @@
+"""
+Drives a local Nerfzari server with simulated players over SSH and reports
+login and command latency percentiles and sessions per second.
+
+	python benchmarks/ssh_load.py --players 50 --mode thread
+
+Every player logs in, registers and joins one Assassin game. Once the game
+is started each one asks for their target and reports the elimination,
+for a few rounds or until they're out. The server runs from nerfzari.py
+in a temporary directory with AcceptAll logins and its own database.
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import paramiko
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+GAME = 'loadtest'
+
+
+def free_port():
+	with socket.socket() as sock:
+		sock.bind(('127.0.0.1', 0))
+		return sock.getsockname()[1]
+
+
+def percentiles(samples):
+	"""
+	:returns: The 50th, 90th and 99th percentiles and the maximum of
+		samples, in milliseconds.
+	"""
+	if not samples:
+		return [0.0] * 4
+	ordered = sorted(samples)
+	pick = lambda p: ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+	return [pick(x) * 1000 for x in (0.5, 0.9, 0.99)] + [ordered[-1] * 1000]
+
+
+class Server(object):
+	"""Runs nerfzari.py in tmp until the block exits."""
+
+	def __init__(self, tmp, mode, max_sessions):
+		self.tmp = tmp
+		self.port = free_port()
+		self.mode = mode
+		self.max_sessions = max_sessions
+		self.proc = None
+
+	def __enter__(self):
+		key_path = os.path.join(self.tmp, 'host.pem')
+		paramiko.RSAKey.generate(2048).write_private_key_file(key_path)
+		cfg = {
+			'listen_port': self.port,
+			'rsa_key': key_path,
+			'auth_cls': 'AcceptAll',
+			'workers': { 'mode': self.mode, 'max_sessions': self.max_sessions, 'backlog': 128 }
+		}
+		with open(os.path.join(self.tmp, 'nerfzari.json'), 'w') as f:
+			json.dump(cfg, f)
+		self.log = open(os.path.join(self.tmp, 'server.out'), 'w')
+		self.proc = subprocess.Popen(
+			[sys.executable, os.path.join(ROOT, 'nerfzari.py')],
+			cwd=self.tmp, stdout=self.log, stderr=subprocess.STDOUT
+		)
+		deadline = time.monotonic() + 15
+		while time.monotonic() < deadline:
+			if self.proc.poll() is not None:
+				break
+			try:
+				socket.create_connection(('127.0.0.1', self.port), 0.2).close()
+				return self
+			except OSError:
+				time.sleep(0.1)
+		self.__exit__(None, None, None)
+		with open(self.log.name) as f:
+			raise RuntimeError('server did not start:\n' + f.read())
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if self.proc.poll() is None:
+			self.proc.send_signal(signal.SIGINT)
+			try:
+				self.proc.wait(10)
+			except subprocess.TimeoutExpired:
+				self.proc.kill()
+				self.proc.wait()
+		self.log.close()
+
+
+class Recorder(object):
+	"""Collects latencies by kind from every client thread."""
+
+	def __init__(self):
+		self.samples = {}
+		self.errors = 0
+		self._lock = threading.Lock()
+
+	def add(self, kind, elapsed):
+		with self._lock:
+			self.samples.setdefault(kind, []).append(elapsed)
+
+	def error(self):
+		with self._lock:
+			self.errors += 1
+
+
+class Player(object):
+	"""One simulated player with its own SSH connection."""
+
+	def __init__(self, port, name, recorder):
+		self.port = port
+		self.name = name
+		self.recorder = recorder
+		self.client = None
+		self.tag = None
+
+	def login(self):
+		self.client = paramiko.SSHClient()
+		self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+		start = time.perf_counter()
+		self.client.connect(
+			'127.0.0.1', self.port, username=self.name, password='load',
+			look_for_keys=False, allow_agent=False, timeout=30, banner_timeout=30, auth_timeout=30
+		)
+		self.recorder.add('login', time.perf_counter() - start)
+
+	def run(self, kind, text):
+		"""Runs text as an exec session and returns its output."""
+		start = time.perf_counter()
+		_, out, _ = self.client.exec_command(text, timeout=30)
+		data = out.read().decode('utf-8', 'replace')
+		out.channel.recv_exit_status()
+		self.recorder.add(kind, time.perf_counter() - start)
+		return data
+
+	def close(self):
+		if self.client is not None:
+			self.client.close()
+
+
+def join(player):
+	try:
+		player.login()
+		out = player.run('register+join', '{0}\n{0}@example.com\ngame join {1}'.format(player.name, GAME))
+		for line in out.splitlines():
+			if line.startswith('your game tag is '):
+				player.tag = line.split()[-1]
+	except Exception:
+		player.recorder.error()
+	return player
+
+
+def hunt(player, tags, rounds):
+	"""Asks for a target and reports it, until out of rounds or targets."""
+	try:
+		for _ in range(rounds):
+			out = player.run('target', 'target {}'.format(GAME))
+			if 'your target is: ' not in out:
+				return
+			name = out.split('your target is: ', 1)[1].split()[0]
+			player.run('eliminate', 'eliminate {}'.format(tags[name]))
+	except Exception:
+		player.recorder.error()
+
+
+def load(port, players, rounds, concurrency):
+	"""
+	:returns: The recorder, the number of exec sessions run and the
+		seconds the players took.
+	"""
+	recorder = Recorder()
+	organizer = Player(port, 'organizer', Recorder()) # setup, not measured
+	organizer.login()
+	start_date = (datetime.now() + timedelta(days=1)).strftime('%m/%d/%Y')
+	organizer.run('register+create', 'Organizer\norganizer@example.com\ngame new\nassassin\n{}\n{}\n'.format(GAME, start_date))
+	crowd = [Player(port, 'player{}'.format(x), recorder) for x in range(players)]
+	start = time.perf_counter()
+	with ThreadPoolExecutor(concurrency) as pool:
+		crowd = list(pool.map(join, crowd))
+		organizer.run('start', 'game start {}'.format(GAME))
+		tags = { x.name: x.tag for x in crowd if x.tag is not None }
+		list(pool.map(lambda x: hunt(x, tags, rounds), [x for x in crowd if x.tag is not None]))
+	elapsed = time.perf_counter() - start
+	for player in crowd + [organizer]:
+		player.close()
+	sessions = sum(len(v) for k, v in recorder.samples.items() if k != 'login')
+	return recorder, sessions, elapsed
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--players', type=int, default=50)
+	parser.add_argument('--rounds', type=int, default=3, help='target and eliminate rounds per player')
+	parser.add_argument('--concurrency', type=int, default=0, help='clients at once, defaults to every player')
+	parser.add_argument('--mode', default='thread', help='the server worker mode, see nerfzari.json')
+	parser.add_argument('--max-sessions', type=int, default=256)
+	args = parser.parse_args()
+	with tempfile.TemporaryDirectory() as tmp:
+		with Server(tmp, args.mode, args.max_sessions) as server:
+			recorder, sessions, elapsed = load(server.port, args.players, args.rounds, args.concurrency or args.players)
+	print('{:>16}  {:>6}  {:>9}  {:>9}  {:>9}  {:>9}'.format('', 'count', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+	for kind in ['login', 'register+join', 'target', 'eliminate']:
+		samples = recorder.samples.get(kind, [])
+		print('{:>16}  {:>6}  {:>9.1f}  {:>9.1f}  {:>9.1f}  {:>9.1f}'.format(kind, len(samples), *percentiles(samples)))
+	print('{} sessions in {:.2f} s: {:.1f} sessions/s, {} client errors'.format(
+		sessions, elapsed, sessions / elapsed, recorder.errors))
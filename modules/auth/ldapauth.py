@@ -1,8 +1,13 @@
 """
 """
 
+import collections
 import ldap3
-from nerfzari import Authenticator
+import logging
+import os
+import threading
+import time
+from nerfzari import Authenticator, AuthCache
 from nerfzari import ConfigStore, Configurable
 
 LDAP_CFG_PATH = 'ldap.json'
@@ -32,6 +37,58 @@ LDAP_CFG_SCHEMA = {
 				'digest-md5',
 				'gssapi'
 			]
+		},
+		'pool': {
+			'description': 'Reuse open connections, rebinding them as each user',
+			'type': 'object',
+			'default': {},
+			'properties': {
+				'size': {
+					'description': 'Most connections open at once, 0 disables pooling. Each session '
+						'worker keeps its own pool, so this does nothing in the process worker mode',
+					'type': 'integer',
+					'minimum': 0,
+					'default': 0
+				},
+				'idle_timeout': {
+					'type': 'number',
+					'minimum': 0,
+					'default': 300
+				},
+				'timeout': {
+					'description': 'Seconds a login waits for a free connection before failing',
+					'type': 'number',
+					'minimum': 0,
+					'default': 10
+				}
+			}
+		},
+		'cache': {
+			'description': 'Remember credential checks so repeated logins skip LDAP. Each session '
+				'worker keeps its own cache, so this does nothing in the process worker mode',
+			'type': 'object',
+			'default': {},
+			'properties': {
+				'enabled': {
+					'type': 'boolean',
+					'default': False
+				},
+				'ttl': {
+					'type': 'number',
+					'minimum': 0,
+					'default': 300
+				},
+				'negative_ttl': {
+					'type': 'number',
+					'minimum': 0,
+					'default': 30
+				},
+				'max_size': {
+					'type': 'integer',
+					'minimum': 1,
+					'default': 1024
+				}
+			}
 		}
 	}
 }
@@ -40,8 +97,130 @@ ConfigStore.register(
 	LDAP_CFG_SCHEMA
 )
 
+log = logging.getLogger(__name__)
+
+class LDAPConnectionPool(object):
+	"""
+	Keeps at most size LDAP connections open, made by calling factory, and
+	hands them out for one bind at a time. When all of them are in use,
+	:meth:`acquire` waits up to timeout seconds for one to come back.
+	Connections left idle longer than idle_timeout seconds are closed
+	instead of reused. Safe to share between threads; a forked child
+	starts with an empty pool since the parent's sockets aren't its to use.
+	"""
+	def __init__(self, factory, size=4, idle_timeout=300, timeout=10, clock=time.monotonic):
+		self._factory = factory
+		self._size = size
+		self._idle_timeout = idle_timeout
+		self._timeout = timeout
+		self._clock = clock
+		self._lock = threading.Condition()
+		self._idle = collections.deque() # (connection, last used)
+		self._open = 0 # idle and handed out
+		self._pid = os.getpid()
+
+	def __len__(self):
+		return len(self._idle)
+
+	@property
+	def open(self):
+		"""Connections idle or handed out."""
+		return self._open
+
+	def _check_pid(self):
+		if self._pid != os.getpid():
+			self._idle.clear()
+			self._open = 0
+			self._pid = os.getpid()
+
+	@staticmethod
+	def _close(conn):
+		try:
+			conn.unbind()
+		except ldap3.core.exceptions.LDAPException:
+			pass
+
+	def _take(self):
+		"""
+		Takes the most recently used idle connection that is still usable,
+		or a slot for a new one. Call with the lock held.
+
+		:returns: A (connection or None, found, stale connections) tuple.
+		"""
+		stale = []
+		now = self._clock()
+		while self._idle:
+			conn, last_used = self._idle.pop()
+			if now - last_used <= self._idle_timeout and not conn.closed:
+				return conn, True, stale
+			stale.append(conn)
+			self._open -= 1
+		if self._open < self._size:
+			self._open += 1
+			return None, True, stale
+		return None, False, stale
+
+	def acquire(self):
+		"""
+		:returns: An open connection, reusing the most recently used idle
+			one, or None if every connection stayed in use for timeout seconds.
+		"""
+		stale = []
+		with self._lock:
+			self._check_pid()
+			deadline = time.monotonic() + self._timeout
+			conn, found, closing = self._take()
+			stale += closing
+			while not found:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					break
+				self._lock.wait(remaining)
+				conn, found, closing = self._take()
+				stale += closing
+		for x in stale:
+			self._close(x)
+		if not found or conn is not None:
+			return conn
+		try:
+			return self._factory()
+		except Exception:
+			self._discard()
+			raise
+
+	def _discard(self):
+		"""Gives back the slot of a connection that is gone."""
+		with self._lock:
+			self._open -= 1
+			self._lock.notify()
+
+	def release(self, conn, reuse=True):
+		"""Returns conn to the pool, or closes it if it can't be reused."""
+		with self._lock:
+			self._check_pid()
+			if reuse and not conn.closed:
+				self._idle.append((conn, self._clock()))
+				self._lock.notify()
+				return
+		self._close(conn)
+		self._discard()
+
+	def clear(self):
+		"""Closes every idle connection."""
+		with self._lock:
+			idle = list(self._idle)
+			self._idle.clear()
+			self._open -= len(idle)
+			self._lock.notify_all()
+		for conn, _ in idle:
+			self._close(conn)
+
+
 class LDAPAuthenticator(Authenticator, Configurable):
-	"""An authenticator that uses LDAP to confirm credentials."""
+	"""
+	An authenticator that uses LDAP to confirm credentials. The directory's
+	schema is read once by :meth:`prepare`, logins only bind.
+	"""
 	auth_methods = {
 		'anonymous': ldap3.ANONYMOUS,
 		'simple': ldap3.SIMPLE,
@@ -53,11 +232,17 @@ class LDAPAuthenticator(Authenticator, Configurable):
 		'digest-md5': ldap3.DIGEST_MD5,
 		'gssapi': ldap3.GSSAPI
 	}
-	def __init__(self, host, port=389, method='simple', sasl_mech=None):
+	client_strategy = ldap3.SYNC
+	def __init__(self, host, port=389, method='simple', sasl_mech=None, cache=None,
+		pool_size=0, pool_idle_timeout=300, pool_timeout=10):
 		self._ldap_server = ldap3.Server(host, port, get_info=ldap3.ALL)
-		self._err_msg = None
+		self._local = threading.local() # err_msg is per login, logins run in parallel
 		self._auth_method = self.auth_methods[method]
 		self._sasl_mech = sasl_mech
+		self._cache = cache
+		self._pool = None
+		if pool_size > 0:
+			self._pool = LDAPConnectionPool(self._open_connection, pool_size, pool_idle_timeout, pool_timeout)
 
 	@classmethod
 	def from_cfg(cls):
@@ -65,49 +250,127 @@ class LDAPAuthenticator(Authenticator, Configurable):
 		mech = None
 		if 'sasl_mechanism' in cfg:
 			mech = cfg['sasl_mechanism']
+		cache = None
+		if cfg['cache']['enabled']:
+			cache = AuthCache(
+				cfg['cache']['ttl'],
+				cfg['cache']['negative_ttl'],
+				cfg['cache']['max_size']
+			)
 		return LDAPAuthenticator(
 			cfg['host'],
 			cfg['port'],
 			cfg['auth_method'],
-			mech
+			mech,
+			cache,
+			cfg['pool']['size'],
+			cfg['pool']['idle_timeout'],
+			cfg['pool']['timeout']
 		)
 
+	@property
+	def keeps_state(self):
+		return self._cache is not None or self._pool is not None
+
 	@property
 	def err_msg(self):
-		return self._err_msg
+		"""Why the calling thread's last login failed, or None."""
+		return getattr(self._local, 'err_msg', None)
+
+	def prepare(self):
+		"""Reads the directory's schema so the server has it before it forks."""
+		ldap_conn = ldap3.Connection(
+			self._ldap_server,
+			client_strategy=self.client_strategy,
+			raise_exceptions=False
+		)
+		try:
+			ldap_conn.open() # reads the server info
+		except ldap3.core.exceptions.LDAPException as e:
+			# not fatal, names just won't be checked against the schema
+			log.warning('Could not read LDAP server info: {}'.format(e))
+		finally:
+			ldap_conn.unbind()
 
 	def authenticate(self, username, password):
-		ret = False
+		if self._cache is not None:
+			ret = self._cache.check(username, password)
+			if ret is not None:
+				return ret
+		ret, code = self._ldap_authenticate(username, password)
+		# only remember definite answers, not directory errors
+		if self._cache is not None and (ret or code == 49):
+			self._cache.store(username, password, ret)
+		return ret
+
+	def _new_connection(self, username=None, password=None):
 		if self._auth_method == ldap3.SASL and self._sasl_mech is not None:
-			ldap_conn = ldap3.Connection(
+			return ldap3.Connection(
 				self._ldap_server,
 				authentication=self._auth_method,
 				user=username, password=password,
 				check_names=True,
 				lazy=False,
-				client_strategy=ldap3.SYNC,
+				client_strategy=self.client_strategy,
 				raise_exceptions=False,
 				sasl_mechanism=self._sasl_mech
 			)
-		else:
-			ldap_conn = ldap3.Connection(
-				self._ldap_server,
-				authentication=self._auth_method,
+		return ldap3.Connection(
+			self._ldap_server,
+			authentication=self._auth_method,
+			user=username, password=password,
+			check_names=True,
+			lazy=False,
+			client_strategy=self.client_strategy,
+			raise_exceptions=False
+		)
+
+	def _open_connection(self, username=None, password=None):
+		ldap_conn = self._new_connection(username, password)
+		ldap_conn.open(read_server_info=False) # prepare() already has it
+		return ldap_conn
+
+	def _bind_result(self, ldap_conn):
+		"""
+		:returns: A (success, LDAP result code) tuple for the last bind on ldap_conn.
+		"""
+		code = ldap_conn.result['result']
+		if code == 0: # 0: success, 49: invalidCredentials
+			self._local.err_msg = None
+			return True, code
+		self._local.err_msg = ldap_conn.result['description']
+		return False, code
+
+	def _pooled_authenticate(self, username, password):
+		ldap_conn = self._pool.acquire()
+		if ldap_conn is None:
+			self._local.err_msg = 'No LDAP connection free'
+			return False, None
+		reuse = False
+		try:
+			ldap_conn.rebind(
 				user=username, password=password,
-				check_names=True,
-				lazy=False,
-				client_strategy=ldap3.SYNC,
-				raise_exceptions=False
+				authentication=self._auth_method,
+				sasl_mechanism=self._sasl_mech,
+				read_server_info=False
 			)
-		ldap_conn.open()
-		ldap_conn.bind()
-		if ldap_conn.result['result'] == 0: # 0: success, 49: invalidCredentials
-			ret = True
-			self._err_msg = None
-		else:
-			self.err_msg = ldap_conn.result['description']
+			ret, code = self._bind_result(ldap_conn)
+			reuse = True
+		finally:
+			self._pool.release(ldap_conn, reuse)
+		return ret, code
+
+	def _ldap_authenticate(self, username, password):
+		"""
+		:returns: A (success, LDAP result code) tuple.
+		"""
+		if self._pool is not None:
+			return self._pooled_authenticate(username, password)
+		ldap_conn = self._open_connection(username, password)
+		ldap_conn.bind(read_server_info=False)
+		ret, code = self._bind_result(ldap_conn)
 		ldap_conn.unbind()
-		return ret
+		return ret, code
 
 # register this as an authenticator
 Authenticator.register(LDAPAuthenticator)
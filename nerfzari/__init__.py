@@ -2,9 +2,9 @@
 """
 
 
-from nerfzari.network import Authenticator, SSHServer, SSHCmd
+from nerfzari.network import Authenticator, AuthCache, SSHServer, AsyncSSHServer, SSHCmd
 from nerfzari.config import ConfigStore, Configurable
-from nerfzari.game import GameMeta, User, Player, username
+from nerfzari.game import GameMeta, PlayerMeta, User, UserStats, GameEngine, init_db, release_db, close_db, username
 
 __license__ = 'MIT'
 __all__ = ['network', 'config', 'game']
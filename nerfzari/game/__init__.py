@@ -2,21 +2,47 @@
 """
 
 
-from .models import User, GameMeta, GameBase, PlayerMeta, PlayerBase
+import playhouse.pool
+from . import models
+from .models import User, GameMeta, GameBase, PlayerMeta, PlayerBase, UserStats, DB_PATH, DB_PRAGMAS, database, connect_db
 from .engine import GameEngine
 from .assassin import Assassin, AssassinPlayer
+from .schema import upgrade
 
 
 __license__ = 'MIT'
-__all__ = ['models', 'engine', 'assassin']
-
-
-# create tables
-User.create_table()
-GameMeta.create_table()
-# GameBase is a base class for specific game types and should not be created
-PlayerMeta.create_table()
-# PlayerBase is a base class for specific game types and should not be created
-Assassin.create_table()
-AssassinPlayer.create_table()
-# more tables can be created here
\ No newline at end of file
+__all__ = ['models', 'engine', 'assassin', 'schema']
+
+
+# GameBase and PlayerBase are base classes for specific game types and have no tables
+MODELS = [User, GameMeta, PlayerMeta, UserStats, Assassin, AssassinPlayer] # more tables can be added here
+
+
+def init_db(path=DB_PATH, pragmas=None, url=None, pool_size=0, stale_timeout=300, pool_timeout=10):
+	"""
+	Binds the models to the database described by the arguments, see
+	:func:`models.connect_db`, and creates or upgrades its tables. Call
+	this once at startup, before any sessions or the engine are started.
+	"""
+	database.initialize(connect_db(path, pragmas, url, pool_size, stale_timeout, pool_timeout))
+	upgrade(MODELS)
+
+
+def release_db():
+	"""
+	Hands the calling thread's connection back to the pool between units of
+	work. Without pooling the connection is kept open.
+	"""
+	if isinstance(database.obj, playhouse.pool.PooledDatabase):
+		database.close()
+
+
+def close_db():
+	"""
+	Closes the calling thread's connection and every idle pooled one. The
+	server calls this before forking session workers, which must open
+	connections of their own.
+	"""
+	database.close()
+	if isinstance(database.obj, playhouse.pool.PooledDatabase):
+		database.close_all()
\ No newline at end of file
@@ -5,37 +5,81 @@
 import random
 import peewee
 from datetime import datetime
-from .models import GameBase, PlayerBase, PlayerMeta
+from .models import User, GameMeta, GameBase, PlayerBase, PlayerMeta, UserStats
+
+
+START_BATCH = 300 # rows per UPDATE, keeps bulk_update under SQLite's parameter limit
 
 
 class AssassinPlayer(PlayerBase):
+	"""
+	Players form a ring through target. Eliminated players drop out of it,
+	whoever was hunting them takes over their target.
+	"""
 	FOR_GAMETYPE='Assassin'
-	target = peewee.ForeignKeyField(PlayerMeta, null=True)
+	target = peewee.ForeignKeyField(PlayerMeta, null=True, index=True)
 
 
 class Assassin(GameBase):
 	winner = peewee.ForeignKeyField(PlayerMeta, null=True)
 
 	def start(self):
-		players = [x for x in self.meta.players]
+		"""
+		Shuffles the players into a ring where each one targets the next.
+		The ring is built in memory and written in a single transaction.
+		"""
+		players = list(AssassinPlayer
+			.select()
+			.join(PlayerMeta, on=(AssassinPlayer.meta == PlayerMeta.primary_key))
+			.where(PlayerMeta.game == self.meta_id)
+		)
+		if len(players) == 0:
+			return
 		random.shuffle(players)
-		for idx in range(len(players)-1):
-			players[idx].extension.target = players[idx+1]
-			players[idx].save()
-		players[-1].extension.target = players[0]
-		players[-1].save()
+		for idx, player in enumerate(players):
+			player.target = players[(idx + 1) % len(players)].meta_id
+		with self._meta.database.atomic():
+			AssassinPlayer.bulk_update(players, fields=[AssassinPlayer.target], batch_size=START_BATCH)
 
 	def eliminate(self, player, target):
-		super().eliminate(player, target)
-		remaining = [x for x in PlayerMeta.select().where(PlayerMeta.eliminated_by.is_null())]
-		if len(remaining) == 1:
-			self.winner = remaining[0]
-			self.meta.over = True
-			self.meta.save()
-			self.save()
+		with self._meta.database.atomic():
+			remaining = super().eliminate(player, target)
+			# close the ring over the target in one statement
+			inherited = (AssassinPlayer
+				.select(AssassinPlayer.target)
+				.where(AssassinPlayer.meta == target.primary_key)
+			)
+			(AssassinPlayer
+				.update(target=inherited)
+				.where(AssassinPlayer.target == target.primary_key)
+				.execute()
+			)
+			if remaining == 1: # the player who made the last elimination
+				self.winner = player
+				self.meta.over = True
+				self.meta.save(only=[GameMeta.over])
+				self.save(only=[Assassin.winner])
+				UserStats.record_win(player.user_id)
+		return remaining
 
 	def target(self, user):
-		pmeta = self.meta.players.where(PlayerMeta.user == user)
-		return pmeta.player.target.user
+		"""
+		:returns: The :class:`User` that user is hunting, or None if user is
+			not in the game or has been eliminated.
+		"""
+		hunter = PlayerMeta.alias()
+		target = PlayerMeta.alias()
+		return (User
+			.select()
+			.join(target, on=(target.user == User.primary_key))
+			.join(AssassinPlayer, on=(AssassinPlayer.target == target.primary_key))
+			.join(hunter, on=(AssassinPlayer.meta == hunter.primary_key))
+			.where(
+				(hunter.user == user) &
+				(hunter.game == self.meta_id) &
+				hunter.eliminated_by.is_null()
+			)
+			.first()
+		)
 		
 
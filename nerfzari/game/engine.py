@@ -2,25 +2,270 @@
 """
 
 
+import contextlib
+import heapq
+import logging
+import os
+import queue
+import select
 import threading
-from datetime import datetime
-from .models import GameMeta
+from datetime import datetime, timedelta
+from .models import GameMeta, schedule_listeners
+
+
+log = logging.getLogger(__name__)
+
+
+START = 'start'
+END = 'end'
+
+
+@contextlib.contextmanager
+def connection():
+	"""Opens the calling thread's connection if it isn't, and closes it after."""
+	db = GameMeta._meta.database
+	opened = db.connect(reuse_if_open=True)
+	try:
+		yield
+	finally:
+		if opened:
+			db.close()
+
+
+class GameWorker(threading.Thread):
+	"""
+	Runs the start and end actions handed to it in order. Each game is
+	always handed to the same worker, so two workers never change one game.
+	"""
+	def __init__(self, engine, index):
+		super().__init__(name='GameWorker-{}'.format(index), daemon=True)
+		self.queue = queue.Queue()
+		self._engine = engine
+
+	def run(self):
+		while True:
+			item = self.queue.get()
+			try:
+				if item is None:
+					return
+				with connection():
+					self._engine._fire(*item)
+			except Exception:
+				log.exception('failed to %s game %s', item[1], item[0])
+			finally:
+				self.queue.task_done()
 
 
 class GameEngine(threading.Thread):
-	def __init__(self, group=None, target=None, name=None, args=(), kwargs={}):
+	"""
+	Starts and ends games on schedule. Upcoming start and end dates are
+	kept in a heap and the engine sleeps until the earliest one is due.
+	:func:`models.schedule_changed` wakes it to re-read a game that was
+	created or deleted, through a pipe so that session workers forked
+	after :meth:`start` reach it too. Every resync seconds the whole
+	schedule is re-read anyway, in case a change was missed.
+
+	With workers above 0 the due actions are handed to that many
+	:class:`GameWorker` threads, partitioned by game, so one slow start
+	doesn't hold up the others; otherwise the engine runs them itself.
+	"""
+	def __init__(self, group=None, target=None, name=None, args=(), kwargs={}, clock=datetime.now, resync=300, workers=0):
 		super().__init__(group, target, name, args, kwargs)
 		self.stopped= threading.Event()
+		# game keys, one per line; writes that small are atomic, so any
+		# number of threads and forked processes can share the write end
+		self._wake_r, self._wake_w = os.pipe()
+		os.set_blocking(self._wake_r, False)
+		os.set_blocking(self._wake_w, False)
+		self._wake_lock = threading.Lock() # so a write never lands on a reused descriptor
+		self._partial = b''
+		self._clock = clock
+		self._resync = resync
+		self._next_resync = None
+		self._heap = [] # (when, seq, game key, action)
+		self._due = {} # (game key, action): when, entries in the heap that don't match are stale
+		self._seq = 0
+		self._workers = [GameWorker(self, x) for x in range(workers)]
+
+	def start(self):
+		# listen before returning, so workers forked next inherit the listener
+		schedule_listeners.append(self.notify)
+		super().start()
 
 	def stop(self):
 		self.stopped.set()
+		self._write(b'\n')
+
+	def start_workers(self):
+		for worker in self._workers:
+			worker.start()
+
+	def stop_workers(self):
+		"""Lets the workers finish what they were handed, then ends them."""
+		for worker in self._workers:
+			worker.queue.put(None)
+		for worker in self._workers:
+			if worker.is_alive():
+				worker.join()
+
+	def queue_depths(self):
+		"""
+		:returns: The number of actions waiting on each worker.
+		"""
+		return [x.queue.qsize() for x in self._workers]
+
+	def _dispatch(self, meta_id, action):
+		if not self._workers:
+			try:
+				self._fire(meta_id, action)
+			except Exception:
+				log.exception('failed to %s game %s', action, meta_id)
+			return
+		self._workers[hash(meta_id) % len(self._workers)].queue.put((meta_id, action))
+
+	def _write(self, data):
+		with self._wake_lock:
+			if self._wake_w is None:
+				return # closed, the engine is gone
+			try:
+				os.write(self._wake_w, data)
+			except BlockingIOError:
+				pass # the engine is far behind, its next resync catches up
+
+	def close(self):
+		"""Closes the wake pipe, once run() has returned or if it never will."""
+		with self._wake_lock:
+			for fd in (self._wake_r, self._wake_w):
+				if fd is not None:
+					os.close(fd)
+			self._wake_r = self._wake_w = None
+
+	def notify(self, meta_id):
+		"""Schedule listener, safe to call from any thread or forked process."""
+		self._write('{}\n'.format(GameMeta.primary_key.db_value(meta_id)).encode('ascii'))
+
+	def wait_for_change(self, timeout=None):
+		"""
+		Waits up to timeout seconds, or forever if None, for a notify or stop.
+
+		:returns: True if woken, False if the time ran out.
+		"""
+		return bool(select.select([self._wake_r], [], [], timeout)[0])
+
+	def _drain(self):
+		"""
+		:returns: The set of game keys notified since the last call.
+		"""
+		data = self._partial
+		while True:
+			try:
+				chunk = os.read(self._wake_r, 65536)
+			except BlockingIOError:
+				break
+			if not chunk:
+				break
+			data += chunk
+		*lines, self._partial = data.split(b'\n')
+		return set(GameMeta.primary_key.python_value(x.decode('ascii')) for x in lines if x)
+
+	def _push(self, when, meta_id, action):
+		self._due[(meta_id, action)] = when
+		self._seq += 1
+		heapq.heappush(self._heap, (when, self._seq, meta_id, action))
+
+	def _stale(self, entry):
+		"""Entries are left in the heap when a game is rescheduled or removed."""
+		when, _, meta_id, action = entry
+		return self._due.get((meta_id, action)) != when
+
+	def _unschedule(self, meta_id):
+		self._due.pop((meta_id, START), None)
+		self._due.pop((meta_id, END), None)
+
+	def _schedule(self, meta):
+		self._unschedule(meta.primary_key)
+		if meta.over:
+			return
+		if not meta.started:
+			self._push(meta.start_date, meta.primary_key, START)
+		if meta.end_date is not None:
+			self._push(meta.end_date, meta.primary_key, END)
+
+	def _load(self, now):
+		"""Re-reads the schedule of every game that isn't over."""
+		self._heap = []
+		self._due = {}
+		for meta in GameMeta.select().where(GameMeta.over == False):
+			self._schedule(meta)
+		if self._resync:
+			self._next_resync = now + timedelta(seconds=self._resync)
+		else:
+			self._next_resync = datetime.max
+
+	def _refresh(self, dirty):
+		"""Re-reads the games named by notify since the last pass."""
+		if not dirty:
+			return
+		found = set()
+		for meta in GameMeta.select().where(GameMeta.primary_key.in_(list(dirty))):
+			found.add(meta.primary_key)
+			self._schedule(meta)
+		for meta_id in dirty - found:
+			self._unschedule(meta_id)
+
+	def _fire(self, meta_id, action):
+		meta = GameMeta.get_or_none(GameMeta.primary_key == meta_id)
+		if meta is None or meta.over:
+			return
+		if action == START and not meta.started:
+			log.info('starting game %s', meta.name)
+			meta.start()
+		elif action == END:
+			log.info('ending game %s', meta.name)
+			meta.end()
+
+	def step(self):
+		"""
+		Runs, or hands to the workers, everything that is due.
+
+		:returns: The seconds until the next deadline, None if there are none.
+		"""
+		dirty = self._drain()
+		with connection():
+			now = self._clock()
+			if self._next_resync is None or now >= self._next_resync:
+				self._load(now)
+			else:
+				self._refresh(dirty)
+			while self._heap and self._heap[0][0] <= now:
+				entry = heapq.heappop(self._heap)
+				if self._stale(entry):
+					continue
+				_, _, meta_id, action = entry
+				del self._due[(meta_id, action)]
+				self._dispatch(meta_id, action)
+		# drop stale entries so the head is the real next deadline
+		while self._heap and self._stale(self._heap[0]):
+			heapq.heappop(self._heap)
+		deadline = self._next_resync
+		if self._heap:
+			deadline = min(deadline, self._heap[0][0])
+		if deadline == datetime.max:
+			return None
+		return max((deadline - self._clock()).total_seconds(), 0)
 
 	def run(self):
-		while not self.stopped.is_set():
-			# TODO: check to see if any games need to be started
-			metas = GameMeta.active_games()
-			now = datetime.now
-			for meta in metas:
-				if meta.start_date > now:
-					meta.game.start()
-			self.stopped.wait(10)
\ No newline at end of file
+		self.start_workers()
+		try:
+			while not self.stopped.is_set():
+				try:
+					delay = self.step()
+				except Exception:
+					log.exception('game engine pass failed, retrying')
+					self._next_resync = None # reload everything next time
+					delay = self._resync or 60
+				self.wait_for_change(delay)
+		finally:
+			schedule_listeners.remove(self.notify)
+			self.stop_workers()
+			self.close()
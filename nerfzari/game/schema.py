@@ -0,0 +1,74 @@
+"""
+"""
+
+
+import logging
+import peewee
+from playhouse.migrate import SchemaMigrator, migrate
+from .models import GameMeta, PlayerMeta, UserStats
+
+
+log = logging.getLogger(__name__)
+
+# tables and columns that have to be filled in from existing rows when
+# they are added; a column of None stands for the whole table
+BACKFILL = {
+	('gamemeta', 'alive'): GameMeta.recount_alive,
+	('playermeta', 'kill_count'): PlayerMeta.recount_kills,
+	('userstats', None): UserStats.rebuild,
+}
+
+
+def missing_columns(model):
+	"""
+	:returns: The fields of model that have no column in its table yet.
+	"""
+	columns = set(x.name for x in model._meta.database.get_columns(model._meta.table_name))
+	return [x for x in model._meta.sorted_fields if x.column_name not in columns]
+
+
+def create_indexes(model):
+	"""
+	Creates the indexes model declares that its table doesn't have yet. An
+	index that can't be built, such as a unique index over rows that aren't
+	unique, is logged and skipped.
+	"""
+	for index in model._meta.fields_to_index():
+		try:
+			model._meta.database.execute(model._schema._create_index(index, safe=True))
+		except peewee.IntegrityError as e:
+			log.warning('Could not create index on {}: {}'.format(model._meta.table_name, e))
+
+
+def upgrade(models):
+	"""
+	Brings the tables for models up to date with their definitions: creates
+	missing tables, adds missing columns and creates missing indexes. It is
+	safe to run against an up to date database.
+
+	:returns: A list of the (table, column) pairs that were added.
+	"""
+	added = []
+	created = []
+	for model in models:
+		table = model._meta.table_name
+		if not model.table_exists():
+			model.create_table()
+			created.append((table, None))
+			continue
+		fields = missing_columns(model)
+		if len(fields) > 0:
+			database = model._meta.database
+			if isinstance(database, peewee.DatabaseProxy):
+				database = database.obj
+			migrator = SchemaMigrator.from_database(database)
+			with database.atomic():
+				migrate(*[migrator.add_column(table, x.column_name, x) for x in fields])
+			for field in fields:
+				log.info('Added column {}.{}'.format(table, field.column_name))
+				added.append((table, field.column_name))
+		create_indexes(model)
+	for column in created + added:
+		if column in BACKFILL:
+			BACKFILL[column]()
+	return added
@@ -5,29 +5,110 @@ http://wordrequest.com
 
 """
 
+import array
+import functools
 import random
 from os.path import abspath, join, dirname
 
 ADJECTIVE_FILE = abspath(join(dirname(__file__), 'adjective.txt'))
 NOUN_FILE = abspath(join(dirname(__file__), 'noun.txt'))
 
-def generate_username(adj_len=None, noun_len=None):
-	def choose(path, maxlen=None):
+
+class WordIndex(object):
+	"""
+	A word list ordered by length, so the words of at most n letters are
+	always the first count(n) entries and can be picked from in O(1).
+	"""
+	def __init__(self, words):
+		self._words = tuple(sorted(words, key=len))
+		longest = len(self._words[-1]) if self._words else 0
+		# _counts[n] is the number of words of at most n letters
+		self._counts = array.array('L', [0] * (longest + 1))
+		for word in self._words:
+			self._counts[len(word)] += 1
+		for n in range(1, longest + 1):
+			self._counts[n] += self._counts[n - 1]
+
+	def __len__(self):
+		return len(self._words)
+
+	def __getitem__(self, idx):
+		return self._words[idx]
+
+	@staticmethod
+	def from_file(path):
 		with open(path, 'r') as f:
-			words = []
-			while True:
-				line = f.readline()
-				if not line:
-					break
-				if maxlen is not None and  len(line) > maxlen:
-						continue
-				words.append(line)
-		ret = random.choice(words)
-		del words[:]
-		return ret.strip()
-	adjective = choose(ADJECTIVE_FILE, adj_len)
-	noun = choose(NOUN_FILE, noun_len)
+			return WordIndex(x for x in (line.strip() for line in f) if x)
+
+	def count(self, maxlen=None):
+		"""
+		:returns: The number of words of at most maxlen letters.
+		"""
+		if maxlen is None or maxlen >= len(self._counts):
+			return len(self._words)
+		if maxlen < 0:
+			return 0
+		return self._counts[maxlen]
+
+	def choice(self, maxlen=None, rng=random):
+		count = self.count(maxlen)
+		if count == 0:
+			raise ValueError('No words of at most {} letters'.format(maxlen))
+		return self._words[rng.randrange(count)]
+
+
+@functools.lru_cache(maxsize=None)
+def load_words(path):
+	"""Reads a word list once per process."""
+	return WordIndex.from_file(path)
+
+
+def adjectives():
+	return load_words(ADJECTIVE_FILE)
+
+
+def nouns():
+	return load_words(NOUN_FILE)
+
+
+def generate_username(adj_len=None, noun_len=None, rng=random):
+	adjective = adjectives().choice(adj_len, rng)
+	noun = nouns().choice(noun_len, rng)
 	return '{}{}'.format(adjective, noun.title())
+
+
+def username_count(adj_len=None, noun_len=None):
+	"""
+	:returns: How many distinct usernames fit the length limits.
+	"""
+	return adjectives().count(adj_len) * nouns().count(noun_len)
+
+
+def username_at(idx, adj_len=None, noun_len=None):
+	"""
+	Maps each integer in [0, username_count(adj_len, noun_len)) to its own
+	adjective and noun pair, so distinct usernames can be drawn by sampling
+	integers.
+	"""
+	adj_idx, noun_idx = divmod(idx, nouns().count(noun_len))
+	return '{}{}'.format(adjectives()[adj_idx], nouns()[noun_idx].title())
+
+
+def generate_usernames(n, adj_len=None, noun_len=None, rng=random):
+	"""
+	Generates n usernames at once. Names are drawn independently, so they
+	may repeat.
+	"""
+	adjs = adjectives()
+	adj_count = adjs.count(adj_len)
+	noun_list = nouns()
+	noun_count = noun_list.count(noun_len)
+	if adj_count == 0 or noun_count == 0:
+		raise ValueError('No words fit the length limits')
+	return ['{}{}'.format(
+		adjs[rng.randrange(adj_count)],
+		noun_list[rng.randrange(noun_count)].title()
+	) for _ in range(n)]
 '''
 import time
 try:
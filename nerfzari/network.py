@@ -2,13 +2,24 @@
 """
 
 import abc
+import asyncio
 import cmd
+import codecs
+import collections
+import concurrent.futures
+import hashlib
+import hmac
+import inspect
 import logging
 import multiprocessing
+import multiprocessing.connection
+import os
 import paramiko
 import selectors
+import signal
 import socket
 import threading
+import time
 import nerfzari
 import re
 
@@ -24,8 +35,21 @@ else:
 
 
 class Authenticator(abc.ABC):
-	"""Base class for all authenticators."""
+	"""
+	Base class for all authenticators.
+
+	A server builds one authenticator at startup and shares it with every
+	session: ``authenticate`` is called from many threads at once and the
+	instance is copied into forked session processes, so it must be safe
+	for both. Expensive setup belongs in :meth:`prepare`, not in
+	``authenticate``.
+
+	``keeps_state`` is True for authenticators that remember something
+	between logins, like cached results or open connections. That only
+	helps in the worker modes where a session worker outlives its session.
+	"""
 	_authenticators = {}
+	keeps_state = False
 	@abc.abstractmethod
 	def authenticate(self, username, password):
 		"""
@@ -33,6 +57,12 @@ class Authenticator(abc.ABC):
 		"""
 		pass
 
+	def prepare(self):
+		"""
+		Called once by the server before it starts accepting connections.
+		"""
+		pass
+
 	@staticmethod
 	def register(cls, name=None):
 		if name is None:
@@ -58,81 +88,456 @@ class AcceptAll(Authenticator):
 Authenticator.register(AcceptAll)
 
 
+class AuthCache(object):
+	"""
+	A bounded, thread-safe cache of credential checks for authenticators
+	backed by a slow service. Successful checks are remembered for ``ttl``
+	seconds and failed ones for ``negative_ttl`` seconds; once ``max_size``
+	entries are held the least recently used are evicted. Passwords are only
+	kept as a hash keyed with a salt that is random per cache.
+	"""
+	def __init__(self, ttl=300, negative_ttl=30, max_size=1024, clock=time.monotonic):
+		self._ttl = ttl
+		self._negative_ttl = negative_ttl
+		self._max_size = max_size
+		self._clock = clock
+		self._salt = os.urandom(16)
+		self._lock = threading.Lock()
+		self._hits = collections.OrderedDict() # username -> (digest, expiry)
+		self._misses = collections.OrderedDict() # digest -> expiry
+
+	def _digest(self, username, password):
+		msg = '{}\0{}'.format(username, password).encode('utf-8')
+		return hmac.new(self._salt, msg, hashlib.sha256).digest()
+
+	@staticmethod
+	def _bound(entries, size):
+		while len(entries) > size:
+			entries.popitem(last=False)
+
+	def check(self, username, password):
+		"""
+		:returns: The cached result for these credentials, or None if there is none.
+		"""
+		digest = self._digest(username, password)
+		now = self._clock()
+		with self._lock:
+			hit = self._hits.get(username)
+			if hit is not None:
+				if hit[1] <= now:
+					del self._hits[username]
+				elif hmac.compare_digest(hit[0], digest):
+					self._hits.move_to_end(username)
+					return True
+			expiry = self._misses.get(digest)
+			if expiry is not None:
+				if expiry <= now:
+					del self._misses[digest]
+				else:
+					return False
+		return None
+
+	def store(self, username, password, result):
+		"""Remembers the result of checking these credentials."""
+		digest = self._digest(username, password)
+		now = self._clock()
+		with self._lock:
+			if result:
+				if self._ttl > 0:
+					self._hits[username] = (digest, now + self._ttl)
+					self._hits.move_to_end(username)
+					self._bound(self._hits, self._max_size)
+				self._misses.pop(digest, None)
+			elif self._negative_ttl > 0:
+				self._misses[digest] = now + self._negative_ttl
+				self._misses.move_to_end(digest)
+				self._bound(self._misses, self._max_size)
+
+	def invalidate(self, username=None):
+		"""Forgets the cached success for username, or everything if it is None."""
+		with self._lock:
+			if username is None:
+				self._hits.clear()
+				self._misses.clear()
+			else:
+				self._hits.pop(username, None)
+
+	def __len__(self):
+		return len(self._hits) + len(self._misses)
+
+
+class HostKeyCache(object):
+	"""
+	Parses the server's host keys once and hands the parsed keys to every
+	session. Keys are re-parsed after :meth:`invalidate` is called or, when
+	``check_mtime`` is set, after one of the key files changes on disk.
+	"""
+	key_types = [paramiko.RSAKey, paramiko.ECDSAKey, paramiko.Ed25519Key]
+	def __init__(self, paths, check_mtime=False):
+		if isinstance(paths, str):
+			paths = [paths]
+		self._paths = list(paths)
+		self._check_mtime = check_mtime
+		self._lock = threading.Lock()
+		self._keys = None
+		self._mtimes = None
+		self._stale = False
+
+	def __getstate__(self):
+		# parsed keys can't be pickled; spawned workers parse their own copy
+		state = self.__dict__.copy()
+		del state['_lock']
+		state['_keys'] = None
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def load_key(path):
+		"""
+		:returns: The private key in path, whichever of the supported types it is.
+		"""
+		for key_cls in HostKeyCache.key_types:
+			try:
+				return key_cls(filename=path)
+			except paramiko.SSHException:
+				continue
+		raise paramiko.SSHException('Unsupported host key type: {}'.format(path))
+
+	def _file_mtimes(self):
+		return [os.stat(x).st_mtime for x in self._paths]
+
+	def _needs_reload(self):
+		if self._keys is None or self._stale:
+			return True
+		return self._check_mtime and self._mtimes != self._file_mtimes()
+
+	def invalidate(self):
+		"""Forces the keys to be re-parsed the next time they are requested."""
+		self._stale = True
+
+	def keys(self):
+		"""
+		:returns: The parsed host keys, re-parsing them first if they are stale.
+		"""
+		with self._lock:
+			if self._needs_reload():
+				try:
+					mtimes = self._file_mtimes()
+					keys = [self.load_key(x) for x in self._paths]
+				except (OSError, paramiko.SSHException):
+					if self._keys is None:
+						raise
+					log.exception('Failed to reload host keys, keeping the current keys')
+				else:
+					self._keys = keys
+					self._mtimes = mtimes
+					log.info('Loaded host keys: {}'.format(', '.join(x.get_name() for x in keys)))
+				self._stale = False
+			return self._keys
+
+
 class SSHServer(object):
-	"""A SSH server"""
-	def __init__(self, addr, key_path, cmd_cls, auth_cls):
+	"""
+	A SSH server. Sessions are handed to workers according to ``worker_mode``:
+
+	* ``process`` - a new process is forked for every accepted connection
+	  and exits with it, taking anything the authenticator cached along
+	* ``prefork`` - ``max_sessions`` worker processes are forked up front and
+	  each accepts and serves connections one at a time
+	* ``thread`` - sessions run on a pool of ``max_sessions`` threads
+
+	Once ``max_sessions`` sessions are running, new clients wait in the listen
+	backlog of ``backlog`` connections until a slot frees up. A ``max_sessions`` of 0 means unlimited in
+	process mode and one worker per CPU in prefork mode.
+
+	``key_path`` is a host key file or a list of them. Keys are parsed once
+	here and shared with the workers; with ``reload_keys`` set they are
+	re-parsed when a key file changes or the server receives SIGHUP.
+	"""
+	worker_modes = ['process', 'prefork', 'thread']
+	exec_idle_timeout = 60
+	def __init__(self, addr, key_path, cmd_cls, auth_cls, worker_mode='prefork', max_sessions=64, backlog=128,
+		reload_keys=False):
+		if worker_mode not in self.worker_modes:
+			raise ValueError('Unknown worker mode: {}'.format(worker_mode))
+		if worker_mode == 'thread' and max_sessions <= 0:
+			raise ValueError('thread worker mode requires a positive max_sessions')
+		if worker_mode == 'prefork' and max_sessions <= 0:
+			max_sessions = multiprocessing.cpu_count()
 		self._ssock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		self._ssock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 		self._ssock.bind(addr)
 		self._procs = []
 		self._running = True
 		self._is_shutdown = threading.Event()
-		self._auth_cls = auth_cls
-		self._key_path = key_path
+		self._auth = self._make_authenticator(auth_cls)
+		self._auth.prepare() # once here, before any session worker starts
+		if worker_mode == 'process' and self._auth.keeps_state:
+			log.warning('{} caches between logins, but process mode starts every session '
+				'with an empty copy; use prefork or thread mode'.format(type(self._auth).__name__))
+		self._host_keys = HostKeyCache(key_path, check_mtime=reload_keys)
+		self._host_keys.keys() # parse now so a bad key fails at startup
+		self._reload_keys = reload_keys
+		self._pid = os.getpid()
+		self._workers = []
 		self._cmd_cls = cmd_cls
+		self._worker_mode = worker_mode
+		self._max_sessions = max_sessions
+		self._backlog = backlog
+		self._sessions = 0
+		self._active = multiprocessing.Value('i', 0) # sessions being served by worker processes
+		self._slots = threading.Condition()
+		self._conns = set()
+		self._pool = None
+
+	@staticmethod
+	def _make_authenticator(auth_cls):
+		"""Builds the authenticator shared by every session."""
+		if issubclass(auth_cls, nerfzari.Configurable):
+			return auth_cls.from_cfg()
+		return auth_cls()
+
+	@property
+	def worker_mode(self):
+		return self._worker_mode
+
+	@property
+	def max_sessions(self):
+		return self._max_sessions
+
+	@property
+	def sessions(self):
+		"""The number of sessions currently being served."""
+		if self._worker_mode == 'thread':
+			return self._sessions
+		return self._active.value
+
+	@staticmethod
+	def _close_session(conn, tport=None, chan=None):
+		if chan is not None:
+			chan.close()
+		if tport is not None:
+			tport.close()
+		if conn is not None:
+			conn.close()
+
+	@staticmethod
+	def _session_request(addr, chan, iface, timeout=10):
+		"""
+		Waits for the client to ask for a shell or a command on chan.
+
+		:returns: A (channel, command) tuple where command is None for a shell,
+			or (None, None) if the client did not ask, in which case chan is closed.
+		"""
+		requested, command = iface.pop_request(chan, timeout)
+		if not requested:
+			log.warning('Client at {}:{} did not ask for a shell or command'.format(addr[0], addr[1]))
+			chan.close()
+			return None, None
+		return chan, command
+
+	@staticmethod
+	def _next_exec(addr, tport, iface):
+		"""
+		Waits up to exec_idle_timeout seconds for a scripted client to open its
+		next channel on an existing connection.
+
+		:returns: A (channel, command) tuple, or (None, None).
+		"""
+		deadline = time.monotonic() + SSHServer.exec_idle_timeout
+		while tport.is_active() and time.monotonic() < deadline:
+			chan = tport.accept(1)
+			if chan is not None:
+				return SSHServer._session_request(addr, chan, iface)
+		return None, None
 
 	@staticmethod
-	def _ssh_process(addr, conn, key_path, cmd_cls, auth_cls):
+	def _handshake(addr, conn, host_keys, auth):
+		"""
+		Negotiates SSH on conn and waits for the client to ask for a shell or
+		a command.
+
+		:returns: A (transport, channel, interface, command) tuple, or None if
+			the client did not get that far, in which case the connection is closed.
+		"""
 		chan = None
 		tport = None
-		def cleanup():
-			if chan is not None:
-				chan.close()
-			if tport is not None:
-				tport.close()
-			if conn is not None:
-				conn.close()
 		try:
-			key = paramiko.RSAKey(filename=key_path)
+			# commands and keystrokes are small writes, don't let Nagle hold them back
+			conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 			tport = paramiko.Transport(conn)
 			tport.set_gss_host(socket.getfqdn(''))
-			tport.add_server_key(key)
-			if issubclass(auth_cls, nerfzari.Configurable):
-				auth = auth_cls.from_cfg()
-			else:
-				auth = auth_cls()
+			for key in host_keys.keys():
+				tport.add_server_key(key)
 			iface = SSHInterface(auth)
 			try:
 				tport.start_server(server=iface)
 			except paramiko.SSHException:
 				log.warning('SSH negotiation failed for {}:{}'.format(addr[0], addr[1]))
-				cleanup()
-				return
+				SSHServer._close_session(conn, tport)
+				return None
 			chan = tport.accept(20)
 			if chan is None:
 				log.warning('Client at {}:{} did not open channel'.format(addr[0], addr[1]))
-				cleanup()
-				return
-			iface.event.wait(10)
-			if not iface.event.is_set():
-				log.warning('Client at {}:{} did not ask for shell'.format(addr[0], addr[1]))
-				cleanup()
-				return
-			term = cmd_cls(chan, iface.username)
-			term.cmdloop()
+				SSHServer._close_session(conn, tport)
+				return None
+			chan, command = SSHServer._session_request(addr, chan, iface)
+			if chan is None:
+				SSHServer._close_session(conn, tport)
+				return None
+		except BaseException:
+			SSHServer._close_session(conn, tport, chan)
+			raise
+		return tport, chan, iface, command
+
+	@staticmethod
+	def _ssh_process(addr, conn, host_keys, cmd_cls, auth):
+		session = SSHServer._handshake(addr, conn, host_keys, auth)
+		if session is None:
+			return
+		tport, chan, iface, command = session
+		try:
+			while chan is not None:
+				term = cmd_cls(chan, iface.username)
+				if command is None:
+					term.cmdloop()
+					break
+				term.batchloop(command)
+				# scripted clients may run more commands over the same connection
+				chan.close()
+				chan, command = SSHServer._next_exec(addr, tport, iface)
+		finally:
+			SSHServer._close_session(conn, tport, chan)
+
+	@staticmethod
+	def _counted_process(active, addr, conn, host_keys, cmd_cls, auth):
+		"""Runs _ssh_process in a worker process, counting it in the shared active counter."""
+		with active.get_lock():
+			active.value += 1
+		try:
+			SSHServer._ssh_process(addr, conn, host_keys, cmd_cls, auth)
+		finally:
+			with active.get_lock():
+				active.value -= 1
+
+	@staticmethod
+	def _prefork_worker(ssock, active, host_keys, cmd_cls, auth):
+		while True:
+			conn, addr = ssock.accept()
+			SSHServer._counted_process(active, addr, conn, host_keys, cmd_cls, auth)
+
+	def _thread_session(self, addr, conn):
+		try:
+			SSHServer._ssh_process(addr, conn, self._host_keys, self._cmd_cls, self._auth)
+		except Exception:
+			log.exception('Session for {}:{} failed'.format(addr[0], addr[1]))
 		finally:
-			cleanup()
+			with self._slots:
+				self._conns.discard(conn)
+				self._sessions -= 1
+				self._slots.notify()
+
+	def _wait_for_slot(self, timeout):
+		"""
+		Waits up to timeout seconds for a free session slot.
+
+		:returns: True if a new session may be started.
+		"""
+		if self._max_sessions <= 0:
+			return True
+		if self._worker_mode == 'thread':
+			with self._slots:
+				return self._slots.wait_for(lambda: self._sessions < self._max_sessions, timeout)
+		procs = multiprocessing.active_children() # pylint: disable=E1102
+		if len(procs) < self._max_sessions:
+			return True
+		multiprocessing.connection.wait([proc.sentinel for proc in procs], timeout)
+		return False
+
+	def _dispatch(self, addr, conn):
+		if self._worker_mode == 'thread':
+			with self._slots:
+				self._sessions += 1
+				self._conns.add(conn)
+			self._pool.submit(self._thread_session, addr, conn)
+		else:
+			self._host_keys.keys() # refresh in the parent so the child inherits parsed keys
+			proc = multiprocessing.Process(
+				target=SSHServer._counted_process,
+				args=(self._active, addr, conn, self._host_keys, self._cmd_cls, self._auth)
+			)
+			proc.daemon = True
+			proc.start()
+			# the child has its own copy of the connection
+			conn.close()
+
+	def _serve_accept(self, poll_interval):
+		if self._worker_mode == 'thread':
+			self._pool = concurrent.futures.ThreadPoolExecutor(
+				max_workers=self._max_sessions, thread_name_prefix='ssh-session')
+		with ServerSelector() as selector:
+			selector.register(self._ssock, selectors.EVENT_READ)
+			while self._running:
+				if not self._wait_for_slot(poll_interval):
+					continue
+				ready = selector.select(poll_interval)
+				if len(ready) > 0: # we are only selecting on the server socket
+					conn, addr = self._ssock.accept()
+					self._dispatch(addr, conn)
+
+	def _serve_prefork(self, poll_interval):
+		while self._running:
+			self._workers = [x for x in self._workers if x.is_alive()]
+			while len(self._workers) < self._max_sessions:
+				self._host_keys.keys()
+				proc = multiprocessing.Process(
+					target=SSHServer._prefork_worker,
+					args=(self._ssock, self._active, self._host_keys, self._cmd_cls, self._auth)
+				)
+				proc.daemon = True
+				proc.start()
+				self._workers.append(proc)
+			multiprocessing.connection.wait([x.sentinel for x in self._workers], poll_interval)
+
+	def _handle_sighup(self, signum, frame):
+		self._host_keys.invalidate()
+		if os.getpid() == self._pid:
+			log.info('SIGHUP received, reloading host keys')
+			# prefork workers hold their own copy of the keys
+			for proc in self._workers:
+				if proc.pid is not None:
+					os.kill(proc.pid, signal.SIGHUP)
+
+	def _install_sighup(self):
+		if self._reload_keys and hasattr(signal, 'SIGHUP') \
+			and threading.current_thread() is threading.main_thread():
+			signal.signal(signal.SIGHUP, self._handle_sighup)
 
 	def serve_forever(self, poll_interval=0.5):
-		self._ssock.listen(5)
+		self._ssock.listen(self._backlog)
+		self._install_sighup()
 		try:
-			with ServerSelector() as selector:
-				selector.register(self._ssock, selectors.EVENT_READ)
-				while self._running:
-					ready = selector.select(poll_interval)
-					if len(ready) > 0: # we are only selecting on the server socket
-						conn, addr = self._ssock.accept()
-						proc = multiprocessing.Process(
-							target=SSHServer._ssh_process,
-							args=(addr, conn, self._key_path, self._cmd_cls, self._auth_cls)
-						)
-						proc.daemon = True
-						proc.start()
+			if self._worker_mode == 'prefork':
+				self._serve_prefork(poll_interval)
+			else:
+				self._serve_accept(poll_interval)
 		finally:
 			# Note: pylint has a false positive here claiming active_children is not callable
 			for proc in multiprocessing.active_children(): # pylint: disable=E1102
 				proc.terminate()
 				proc.join()
+			if self._pool is not None:
+				with self._slots:
+					conns = list(self._conns)
+				for conn in conns:
+					try:
+						conn.shutdown(socket.SHUT_RDWR)
+					except OSError:
+						pass
+				self._pool.shutdown(wait=True)
 			self._ssock.close()
 			self._is_shutdown.set()
 
@@ -148,17 +553,228 @@ class SSHServer(object):
 		self._is_shutdown.wait()
 
 
+class AsyncSSHServer(SSHServer):
+	"""
+	A SSH server that multiplexes its sessions on a single asyncio event loop.
+
+	paramiko still runs one transport thread per connection, but a session
+	waiting for input holds no worker: the loop watches its channel, does
+	the line editing itself and sends output as the client's window allows.
+	Handshakes and command bodies, which block on the database, run on a
+	pool of ``max_workers`` threads. Commands that ask for more input
+	should do so with :meth:`SSHCmd.ask`, which hands the prompt back to
+	the loop; one calling :meth:`SSHCmd.terminput` holds its worker until
+	the user answers. ``max_sessions`` bounds the connected sessions, 0 is
+	unlimited.
+	"""
+	worker_modes = ['async']
+	def __init__(self, addr, key_path, cmd_cls, auth_cls, worker_mode='async', max_sessions=0, backlog=128,
+		reload_keys=False, max_workers=16):
+		super().__init__(addr, key_path, cmd_cls, auth_cls, worker_mode, max_sessions, backlog, reload_keys)
+		self._max_workers = max_workers
+		self._tasks = set()
+
+	@property
+	def sessions(self):
+		return len(self._tasks)
+
+	@staticmethod
+	async def _readable(chan):
+		"""Waits until chan has input or has been closed."""
+		if chan.recv_ready() or chan.closed or chan.eof_received:
+			return
+		loop = asyncio.get_event_loop()
+		ready = loop.create_future()
+		fd = chan.fileno()
+		loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+		try:
+			await ready
+		finally:
+			loop.remove_reader(fd)
+
+	@staticmethod
+	async def _flush(term, chan):
+		"""Sends term's buffered output, waiting on the loop while the client's window is full."""
+		data = term.take_output()
+		delay = 0.005
+		while data:
+			if chan.send_ready():
+				try:
+					data = data[chan.send(data):]
+				except OSError: # channel closed
+					return
+				delay = 0.005
+			else:
+				await asyncio.sleep(delay)
+				delay = min(delay * 2, 0.1)
+
+	async def _readline(self, term, chan, prompt, tab_complete=True, tab_completer=None):
+		editor = term.start_input(prompt, tab_complete, tab_completer)
+		while True:
+			line = term.edit(editor)
+			if line is not None:
+				return line
+			await self._flush(term, chan)
+			await self._readable(chan)
+			data = chan.recv(term.recv_size)
+			if not data: # channel closed
+				return ''
+			term.receive(data)
+
+	async def _answer(self, term, chan, result):
+		"""
+		The event loop side of :meth:`SSHCmd.answer`: the command runs in the
+		pool up to each prompt, and the prompts are read here.
+		"""
+		if not inspect.isgenerator(result):
+			return result
+		loop = asyncio.get_event_loop()
+		prompt, result = await loop.run_in_executor(self._pool, term.resume, result)
+		while prompt is not None:
+			line = await self._readline(term, chan, prompt.text, prompt.tab_complete, prompt.tab_completer)
+			prompt, result = await loop.run_in_executor(self._pool, term.resume, result, line)
+		return result
+
+	async def _runcmd(self, term, chan, line):
+		"""The event loop side of :meth:`SSHCmd.runcmd`."""
+		loop = asyncio.get_event_loop()
+		line, result = await loop.run_in_executor(self._pool, term.begincmd, line)
+		stop = await self._answer(term, chan, result)
+		return await loop.run_in_executor(self._pool, term.endcmd, stop, line)
+
+	async def _cmdloop(self, term, chan):
+		"""The event loop side of :meth:`SSHCmd.cmdloop`."""
+		loop = asyncio.get_event_loop()
+		# all output goes out through _flush, so neither the loop nor a worker
+		# blocks in sendall on a client whose window is full
+		term.autoflush = False
+		await self._answer(term, chan, await loop.run_in_executor(self._pool, term.preloop))
+		if term.intro:
+			term.poutput(str(term.intro))
+		stop = None
+		while not stop:
+			if term.cmdqueue:
+				stop = await self._runcmd(term, chan, term.cmdqueue.pop(0))
+				continue
+			line = await self._readline(term, chan, term.prompt)
+			if line == '\x03': # ctrl+c
+				stop = await loop.run_in_executor(self._pool, term.runline, line)
+			else:
+				stop = await self._runcmd(term, chan, term.cmdline(line))
+		await loop.run_in_executor(self._pool, term.postloop)
+		await self._flush(term, chan)
+
+	async def _next_exec(self, addr, tport, iface):
+		"""The event loop side of :meth:`SSHServer._next_exec`."""
+		loop = asyncio.get_event_loop()
+		deadline = loop.time() + self.exec_idle_timeout
+		delay = 0.005
+		while tport.is_active() and loop.time() < deadline:
+			chan = tport.accept(0)
+			if chan is not None:
+				return await loop.run_in_executor(
+					self._pool, SSHServer._session_request, addr, chan, iface)
+			# poll quickly at first, clients usually send their next command right away
+			await asyncio.sleep(delay)
+			delay = min(delay * 2, 0.05)
+		return None, None
+
+	async def _session(self, addr, conn):
+		loop = asyncio.get_event_loop()
+		session = await loop.run_in_executor(
+			self._pool, SSHServer._handshake, addr, conn, self._host_keys, self._auth)
+		if session is None:
+			return
+		tport, chan, iface, command = session
+		try:
+			while chan is not None:
+				term = self._cmd_cls(chan, iface.username)
+				if command is None:
+					await self._cmdloop(term, chan)
+					break
+				# batch sessions are short-lived, run them straight through
+				await loop.run_in_executor(self._pool, term.batchloop, command)
+				chan.close()
+				chan, command = await self._next_exec(addr, tport, iface)
+		except Exception:
+			log.exception('Session for {}:{} failed'.format(addr[0], addr[1]))
+		finally:
+			SSHServer._close_session(conn, tport, chan)
+
+	async def _serve(self, poll_interval):
+		loop = asyncio.get_event_loop()
+		slots = None
+		if self._max_sessions > 0:
+			slots = asyncio.Semaphore(self._max_sessions)
+		self._ssock.setblocking(False)
+		while self._running:
+			if slots is not None:
+				try:
+					await asyncio.wait_for(slots.acquire(), poll_interval)
+				except asyncio.TimeoutError:
+					continue
+			try:
+				conn, addr = await asyncio.wait_for(loop.sock_accept(self._ssock), poll_interval)
+			except asyncio.TimeoutError:
+				if slots is not None:
+					slots.release()
+				continue
+			conn.setblocking(True) # paramiko expects a blocking socket
+			task = loop.create_task(self._session(addr, conn))
+			self._tasks.add(task)
+			task.add_done_callback(self._tasks.discard)
+			if slots is not None:
+				task.add_done_callback(lambda _: slots.release())
+		for task in list(self._tasks):
+			task.cancel()
+		if self._tasks:
+			await asyncio.wait(self._tasks)
+
+	def serve_forever(self, poll_interval=0.5):
+		self._ssock.listen(self._backlog)
+		self._install_sighup()
+		self._pool = concurrent.futures.ThreadPoolExecutor(
+			max_workers=self._max_workers, thread_name_prefix='ssh-command')
+		loop = asyncio.new_event_loop() # serve_forever may run off the main thread
+		try:
+			loop.run_until_complete(self._serve(poll_interval))
+		finally:
+			loop.close()
+			self._pool.shutdown(wait=False)
+			self._ssock.close()
+			self._is_shutdown.set()
+
+
 class SSHInterface(paramiko.ServerInterface):
 	"""The Nerfzari SSH server"""
 	def __init__(self, authenticator=AcceptAll()):
 		self.event = threading.Event()
 		self._auth = authenticator
 		self._username = None
+		self._requests = threading.Condition()
+		self._commands = {}
 
 	@property
 	def username(self):
 		return self._username
 
+	def _request(self, channel, command):
+		with self._requests:
+			self._commands[channel.get_id()] = command
+			self._requests.notify_all()
+		self.event.set()
+
+	def pop_request(self, channel, timeout):
+		"""
+		Waits for channel to ask for a shell or a command.
+
+		:returns: A (requested, command) tuple; command is None for a shell.
+		"""
+		with self._requests:
+			if not self._requests.wait_for(lambda: channel.get_id() in self._commands, timeout):
+				return False, None
+			return True, self._commands.pop(channel.get_id())
+
 	def check_channel_request(self, kind, chanid):
 		"""
 		The Nerfzari server only accepts session requests.
@@ -177,7 +793,16 @@ class SSHInterface(paramiko.ServerInterface):
 		return paramiko.AUTH_FAILED
 
 	def check_channel_shell_request(self, channel):
-		self.event.set()
+		self._request(channel, None)
+		return True
+
+	def check_channel_exec_request(self, channel, command):
+		"""
+		Exec requests run their command non-interactively, see :meth:`SSHCmd.batchloop`.
+		"""
+		if isinstance(command, bytes):
+			command = command.decode('utf-8', errors='replace')
+		self._request(channel, command)
 		return True
 
 	def check_channel_pty_request(self, channel, term, width, height, pxwidth, pxheight, modes):
@@ -189,171 +814,461 @@ class SSHInterface(paramiko.ServerInterface):
 		return True
 
 
+class KeyDecoder(object):
+	"""
+	Incrementally splits raw channel input into keys: single characters or
+	whole escape sequences. UTF-8 characters and escape sequences that are
+	split across reads are held back until the rest arrives, and '\\r\\n' or
+	a bare '\\n' is reported as '\\r' so every line ending is one enter key.
+	"""
+	def __init__(self):
+		self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+		self._pending = ''
+		self._after_cr = False
+
+	@staticmethod
+	def _escape_end(text, start):
+		"""
+		:returns: The index just past the escape sequence at start, or None if
+			the sequence is incomplete.
+		"""
+		if start + 1 >= len(text):
+			return None
+		kind = text[start + 1]
+		if kind == '[': # CSI: parameter bytes up to a final byte in '@'..'~'
+			for idx in range(start + 2, len(text)):
+				if '\x40' <= text[idx] <= '\x7e':
+					return idx + 1
+			return None
+		if kind == 'O': # SS3: exactly one more character
+			if start + 2 >= len(text):
+				return None
+			return start + 3
+		return start + 1 # a lone escape key
+
+	def decode(self, data):
+		"""
+		:returns: The list of complete keys received so far.
+		"""
+		text = self._pending + self._decoder.decode(data)
+		keys = []
+		idx = 0
+		while idx < len(text):
+			char = text[idx]
+			if char == '\x1b':
+				end = self._escape_end(text, idx)
+				if end is None:
+					break
+				keys.append(text[idx:end])
+				idx = end
+				self._after_cr = False
+				continue
+			if char == '\n':
+				if not self._after_cr:
+					keys.append('\r')
+			else:
+				keys.append(char)
+			self._after_cr = char == '\r'
+			idx += 1
+		self._pending = text[idx:]
+		return keys
+
+
+class Prompt(object):
+	"""A line of input asked for by a command, see :meth:`SSHCmd.ask`."""
+	def __init__(self, text, tab_complete=True, tab_completer=None):
+		self.text = text
+		self.tab_complete = tab_complete
+		self.tab_completer = tab_completer
+
+
+class LineEditor(object):
+	"""
+	The VT100 line editing state of a single prompt. Keys are fed in one at a
+	time with :meth:`feed`, which echoes the edits into the owning
+	:class:`SSHCmd`'s output buffer and returns the line once it is complete.
+	"""
+	def __init__(self, term, tab_complete=True, tab_completer=None):
+		self._term = term
+		self._write = term.write
+		self._tab_complete = tab_complete
+		self._tab_completer = tab_completer
+		self._line = []
+		self._pos = 0
+		self._history_idx = len(term._cmd_history)
+		self._last_line = None
+		self._tab_ctr = 0
+		self._tab_line = []
+
+	def _clear_prompt(self, curr_line, curr_pos):
+		self._write('\010'*curr_pos)
+		self._write('\000'*len(curr_line))
+		self._write('\010'*len(curr_line))
+
+	def feed(self, data):
+		"""
+		Processes one key of input.
+
+		:returns: The finished line, '\\x03' if the user pressed ctrl+c or None
+			if the line is not finished yet.
+		"""
+		term = self._term
+		history = term._cmd_history
+		line = self._line
+		pos = self._pos
+		if self._tab_ctr > 0 and data != '\t':
+			self._tab_ctr = 0
+			self._tab_line = ''
+		if data.startswith('\x1b'):
+			if data == '\x1b[A': # up arrow key
+				if self._history_idx == len(history):
+					self._last_line = line
+				if self._history_idx > 0:
+					self._history_idx -= 1
+					self._clear_prompt(line, pos)
+					line = list(history[self._history_idx])
+					self._write(''.join(line).strip())
+					pos = len(line)
+
+			elif data == '\x1b[B': # down arrow key
+				if self._history_idx < len(history):
+					self._history_idx += 1
+					self._clear_prompt(line, pos)
+					if self._history_idx == len(history):
+						line = self._last_line
+					else:
+						line = list(history[self._history_idx])
+					self._write(''.join(line).strip())
+					pos = len(line)
+
+			elif data == '\x1b[C': # right arrow key
+				if pos < len(line):
+					self._write(data)
+					pos += 1
+			elif data == '\x1b[D': # left arrow key
+				if pos > 0:
+					self._write(data)
+					pos -= 1
+			elif data == '\x1b[3~': # delete key
+				if len(line) > 0:
+					if pos > 0 and pos < len(line):
+						l = line[:pos]
+						r = line[pos+1:]
+						self._write(''.join(r))
+						self._write('\000')
+						self._write('\010'*(len(line)-pos))
+						line = l + r
+						if len(line) < pos:
+							pos = len(line)
+							self._write('\000')
+
+		elif data == '\x7f': # backspace key
+			if len(line) > 0:
+				if pos > 0 and pos < len(line):
+					pos -= 1
+					l = line[:pos]
+					r = line[pos+1:]
+					self._write('\010')
+					self._write(''.join(r))
+					self._write('\000')
+					self._write('\010'*(len(line)-pos))
+					line = l + r
+				else:
+					self._write('\010\000\010')
+					line = line[:-1]
+					pos -= 1
+
+		elif data == '\t' and self._tab_complete: # tab
+			if self._tab_ctr == 0:
+				self._tab_line = line
+			tab_line = self._tab_line
+			tab_ctr = self._tab_ctr
+			if ' ' in line and self._tab_completer is None: # complete arguments
+				cmd, args, _ = term.parseline(''.join(tab_line))
+				if cmd == None or cmd == '':
+					compfunc = term.completedefault
+				else:
+					try:
+						compfunc = getattr(term, 'complete_' + cmd)
+					except AttributeError:
+						compfunc = term.completedefault
+				term.completion_matches = compfunc(args, tab_line, 0, len(tab_line))
+				if len(term.completion_matches) > 0:
+					if tab_ctr >= 1 and len(term.completion_matches) == 1:
+						return None
+				self._clear_prompt(line, pos)
+				if len(term.completion_matches) > 0:
+					carg = term.completion_matches[tab_ctr % len(term.completion_matches)]
+					line = list(' '.join([cmd, carg]))
+			else: # complete commands
+				if self._tab_completer is None:
+					term.completion_matches = term.completenames(
+						''.join(tab_line), ''.join(tab_line), 0, len(tab_line))
+				else:
+					term.completion_matches = self._tab_completer(
+						''.join(tab_line), ''.join(tab_line), 0, len(tab_line))
+				if len(term.completion_matches) > 0:
+					if tab_ctr >= 1 and len(term.completion_matches) == 1:
+						return None
+				self._clear_prompt(line, pos)
+				if len(term.completion_matches) > 0:
+					line = list(term.completion_matches[tab_ctr % len(term.completion_matches)])
+			self._write(''.join(line).strip())
+			pos = len(line)
+			self._tab_ctr += 1
+
+		else:
+			if '\r' in data:
+				term.poutput('')
+				return ''.join(line).strip()
+			if data >= '\x00' and data <= '\x1a':
+				if data == '\x03': # ctrl+c
+					term.poutput('')
+					return data
+				return None # otherwise, ignore
+			if pos < len(line):
+				r = line[pos:]
+				line.insert(pos, data)
+				self._write(data)
+				self._write(''.join(r))
+				pos += 1
+				self._write('\010'*(len(line)-pos))
+			else:
+				line.append(data)
+				self._write(data)
+				pos += 1
+
+		self._line = line
+		self._pos = pos
+		return None
+
+
 class SSHCmd(cmd.Cmd):
 	"""The command handler of Nerfzari."""
 	use_rawinput = False # never use raw input
 	hidden_cmds = ['do_EOF',]
 	max_history = 1024
+	recv_size = 4096
+	max_buffer = 32768 # bytes
+	autoflush = True # send once max_buffer is reached, rather than at the next flush
+	newline = '\r\n'
+	batch_command = 'batch'
 	def __init__(self, chan, username, completekey='tab'):
 		super().__init__()
 		self._chan = chan
 		self._username = username
 		self._cmd_history = []
+		self._keys = collections.deque()
+		self._decoder = KeyDecoder()
+		self._outbuf = []
+		self._outlen = 0
+		self._batch = False
+		self._batch_stream = False
+		self._status = 0
 
-	def poutput(self, msg, end='\r\n'):
+	@property
+	def batch(self):
+		"""True when running non-interactively from an exec request."""
+		return self._batch
+
+	def write(self, data):
+		"""
+		Buffers output for the channel. The buffer is sent as one write by
+		:meth:`flush`, which happens whenever the session is about to wait
+		for input.
+		"""
+		# paramiko sizes packets by len(), which only counts bytes for bytes
+		data = data.encode('utf-8')
+		self._outbuf.append(data)
+		self._outlen += len(data)
+		if self.autoflush and self._outlen >= self.max_buffer:
+			self.flush()
+
+	def take_output(self):
+		"""
+		:returns: The buffered output, which is then no longer buffered.
+		"""
+		data = b''.join(self._outbuf)
+		self._outbuf = []
+		self._outlen = 0
+		return data
+
+	def flush(self):
+		"""Sends any buffered output."""
+		data = self.take_output()
+		if data:
+			self._chan.sendall(data)
+
+	def poutput(self, msg, end=None):
 		"""Tweaked poutput to use Paramiko channel."""
+		if end is None:
+			end = self.newline
 		if msg is not None:
 			msg_str = '{}'.format(msg)
-			self._chan.send(msg_str)
+			self.write(msg_str)
 			if not msg_str.endswith(end):
-				self._chan.send(end)
+				self.write(end)
 
-	def terminput(self, prompt, tab_complete=True, tab_completer=None):
-		"""Major modification was required to emulate vt100 stuff"""
-		def clear_prompt(curr_line, curr_pos):
-			self._chan.send('\010'*pos)
-			self._chan.send('\000'*len(curr_line))
-			self._chan.send('\010'*len(curr_line))
+	def start_input(self, prompt, tab_complete=True, tab_completer=None):
+		"""
+		Writes the prompt.
 
+		:returns: A :class:`LineEditor` for the reply.
+		"""
 		if prompt[:-1] != ' ':
 			prompt = prompt + ' '
 		self.poutput(prompt, end='')
-		line = []
-		pos = 0
-		history_idx = len(self._cmd_history)
-		last_line = None
-		tab_ctr = 0
-		tab_line = []
+		return LineEditor(self, tab_complete, tab_completer)
+
+	def receive(self, data):
+		"""Decodes data received from the channel and queues the keys it holds."""
+		self._keys.extend(self._decoder.decode(data))
+
+	def edit(self, editor):
+		"""
+		Feeds queued input to editor.
+
+		:returns: The finished line, or None if more input is needed.
+		"""
+		while self._keys:
+			line = editor.feed(self._keys.popleft())
+			if line is not None:
+				return line
+		return None
+
+	def _batch_input(self):
+		"""
+		Reads the next input line in batch mode, without echo or editing.
+
+		:returns: The line, or None at the end of the input.
+		"""
+		chars = []
 		while True:
-			data = self._chan.recv(12).decode('utf-8')
-			if tab_ctr > 0 and data != '\t':
-				tab_ctr = 0
-				tab_line = ''
-			if data.startswith('\x1b'):
-				if data == '\x1b[A': # up arrow key
-					if history_idx == len(self._cmd_history):
-						last_line = line
-					if history_idx > 0:
-						history_idx -= 1
-						clear_prompt(line, pos)
-						line = self._cmd_history[history_idx]
-						self._chan.send(''.join(line).strip())
-						pos = len(line)
-
-				elif data == '\x1b[B': # down arrow key
-					if history_idx < len(self._cmd_history):
-						history_idx += 1
-						clear_prompt(line, pos)
-						if history_idx == len(self._cmd_history):
-							line = last_line
-						else:
-							line = self._cmd_history[history_idx]
-						self._chan.send(''.join(line).strip())
-						pos = len(line)
-
-				elif data == '\x1b[C': # right arrow key
-					if pos < len(line):
-						self._chan.send(data)
-						pos += 1
-				elif data == '\x1b[D': # left arrow key
-					if pos > 0:
-						self._chan.send(data)
-						pos -= 1
-				elif data == '\x1b[3~': # delete key
-					if len(line) > 0:
-						if pos > 0 and pos < len(line):
-							l = line[:pos]
-							r = line[pos+1:]
-							for x in r:
-								self._chan.send(x)
-							self._chan.send('\000')
-							self._chan.send('\010'*(len(line)-pos))
-							line = l + r
-							if len(line) < pos:
-								pos = len(line)
-								self._chan.send('\000')
-
-			elif data == '\x7f': # backspace key
-				if len(line) > 0:
-					if pos > 0 and pos < len(line):
-						pos -= 1
-						l = line[:pos]
-						r = line[pos+1:]
-						self._chan.send('\010')
-						for x in r:
-							self._chan.send(x)
-						self._chan.send('\000')
-						self._chan.send('\010'*(len(line)-pos))
-						line = l + r
-					else:
-						self._chan.send('\010\000\010')
-						line = line[:-1]
-						pos -= 1
-
-			elif data == '\t' and tab_complete: # tab
-				if tab_ctr == 0:
-					tab_line = line
-				if ' ' in line and tab_completer is None: # complete arguments
-					cmd, args, _ = self.parseline(''.join(tab_line))
-					if cmd == None or cmd == '':
-						compfunc = self.completedefault
-					else:
-						try:
-							compfunc = getattr(self, 'complete_' + cmd)
-						except AttributeError:
-							compfunc = self.completedefault
-					self.completion_matches = compfunc(args, tab_line, 0, len(tab_line))
-					if len(self.completion_matches) > 0:
-						if tab_ctr >= 1 and len(self.completion_matches) == 1:
-							continue
-					clear_prompt(line, pos)
-					if len(self.completion_matches) > 0:
-						carg = self.completion_matches[tab_ctr % len(self.completion_matches)]
-						line = list(' '.join([cmd, carg]))
-				else: # complete commands
-					if tab_completer is None:
-						self.completion_matches = self.completenames(
-							''.join(tab_line), ''.join(tab_line), 0, len(tab_line))
-					else:
-						self.completion_matches = tab_completer(
-							''.join(tab_line), ''.join(tab_line), 0, len(tab_line))
-					if len(self.completion_matches) > 0:
-						if tab_ctr >= 1 and len(self.completion_matches) == 1:
-							continue
-					clear_prompt(line, pos)
-					if len(self.completion_matches) > 0:
-						line = list(self.completion_matches[tab_ctr % len(self.completion_matches)])
-				self._chan.send(''.join(line).strip())
-				pos = len(line)
-				tab_ctr += 1
+			while self._keys:
+				key = self._keys.popleft()
+				if key == '\r':
+					return ''.join(chars).strip()
+				if key == '\t' or key >= ' ':
+					chars.append(key)
+			if not self._batch_stream:
+				break
+			self.flush()
+			data = self._chan.recv(self.recv_size)
+			if not data:
+				break
+			self.receive(data)
+		if chars:
+			return ''.join(chars).strip()
+		return None
 
-			else:
-				if '\r' in data:
-					self.poutput('')
-					break
-				if data >= '\x00' and data <= '\x1a':
-					if data == '\x03': # ctrl+c
-						self.poutput('')
-						return data
-					continue # otherwise, ignore
-				if pos < len(line):
-					r = line[pos:]
-					line.insert(pos, data)
-					self._chan.send(data)
-					for x in r:
-						self._chan.send(x)
-					pos += 1
-					self._chan.send('\010'*(len(line)-pos))
-				else:
-					line.append(data)
-					self._chan.send(data)
-					pos += 1
-					
-		return ''.join(line).strip()
+	def terminput(self, prompt, tab_complete=True, tab_completer=None):
+		"""Major modification was required to emulate vt100 stuff"""
+		if self._batch:
+			line = self._batch_input()
+			return line if line is not None else ''
+		editor = self.start_input(prompt, tab_complete, tab_completer)
+		while True:
+			line = self.edit(editor)
+			if line is not None:
+				return line
+			self.flush()
+			data = self._chan.recv(self.recv_size)
+			if not data: # channel closed
+				return ''
+			self.receive(data)
+
+	def ask(self, prompt, tab_complete=True, tab_completer=None):
+		"""
+		Asks for a line from a command or :meth:`preloop` that is written as
+		a generator: ``line = yield self.ask('name>')``. Unlike
+		:meth:`terminput`, the async server doesn't hold a worker thread
+		while the user types the answer.
+		"""
+		return Prompt(prompt, tab_complete, tab_completer)
+
+	@staticmethod
+	def resume(result, answer=None):
+		"""
+		Runs a command that was written as a generator up to its next prompt,
+		sending it answer, the line for the prompt before.
+
+		:returns: A (prompt, result) tuple: the :class:`Prompt` to answer and
+			the generator, or None and what the command returned.
+		"""
+		if not inspect.isgenerator(result):
+			return None, result
+		try:
+			return result.send(answer), result
+		except StopIteration as done:
+			return None, done.value
+
+	def answer(self, result):
+		"""
+		Answers the prompts of a command written as a generator with
+		:meth:`terminput`.
+
+		:returns: What the command returned.
+		"""
+		prompt, result = self.resume(result)
+		while prompt is not None:
+			line = self.terminput(prompt.text, prompt.tab_complete, prompt.tab_completer)
+			prompt, result = self.resume(result, line)
+		return result
+
+	def begincmd(self, line):
+		"""
+		Runs the precmd hook and calls the command; a command written as a
+		generator has not run yet.
+
+		:returns: The line as precmd left it, and what the command returned.
+		"""
+		line = self.precmd(line)
+		return line, self.onecmd(line)
+
+	def endcmd(self, stop, line):
+		"""
+		Runs the postcmd hook and records line in the history.
+
+		:returns: True when the command loop should stop.
+		"""
+		stop = self.postcmd(stop, line)
+		self._cmd_history.append(line)
+		if len(self._cmd_history) > self.max_history:
+			self._cmd_history.pop(0)
+		return stop
+
+	def runcmd(self, line):
+		"""
+		Runs a command line through the cmd hooks and records it in the history.
+
+		:returns: True when the command loop should stop.
+		"""
+		line, result = self.begincmd(line)
+		return self.endcmd(self.answer(result), line)
+
+	@staticmethod
+	def cmdline(line):
+		"""
+		:returns: The command for a line entered at the prompt.
+		"""
+		if not len(line):
+			return 'EOF'
+		return line.rstrip('\r\n')
+
+	def runline(self, line):
+		"""
+		Runs a line entered at the prompt.
+
+		:returns: True when the command loop should stop.
+		"""
+		if line == '\x03': # ctrl+c
+			self.postcmd(True, line)
+			return True
+		return self.runcmd(self.cmdline(line))
 
 	def cmdloop(self, intro=None):
 		""""""
-		self.preloop()
+		self.answer(self.preloop())
 		if intro is not None:
 			self.intro = intro
 		if self.intro:
@@ -361,28 +1276,54 @@ class SSHCmd(cmd.Cmd):
 		stop = None
 		while not stop:
 			if self.cmdqueue:
-				line = self.cmdqueue.pop(0)
+				stop = self.runcmd(self.cmdqueue.pop(0))
 			else:
-				line = self.terminput(self.prompt)
-				if not len(line):
-					line = 'EOF'
-				elif line == '\x03': # ctrl+c
-					stop = True
-					stop = self.postcmd(stop, line)
-					break
-				else:
-					line = line.rstrip('\r\n')
-			line = self.precmd(line)
-			stop = self.onecmd(line)
-			stop = self.postcmd(stop, line)
-			self._cmd_history.append(line)
-			if len(self._cmd_history) > self.max_history:
-				self._cmd_history.pop(0)
+				stop = self.runline(self.terminput(self.prompt))
 		self.postloop()
+		self.flush()
+
+	def batchloop(self, command):
+		"""
+		Runs commands for an exec request and reports an exit status instead
+		of emulating a terminal: nothing is echoed, prompts are not printed
+		and output lines end in '\\n'. command holds one command per line;
+		the command 'batch' instead reads newline delimited commands from the
+		channel until it is closed. Answers to commands that ask for more
+		input are read from the following lines. The exit status is 1 if any
+		command failed or was not recognized.
+		"""
+		self._batch = True
+		self.newline = '\n'
+		if command.strip() == self.batch_command:
+			self._batch_stream = True
+		else:
+			self.receive(command.encode('utf-8') + b'\n')
+		self._status = 0
+		try:
+			self.answer(self.preloop())
+			while True:
+				line = self._batch_input()
+				if line is None:
+					break
+				if not line:
+					continue
+				try:
+					if self.runcmd(line):
+						break
+				except Exception as err:
+					log.exception('Batch command failed: {}'.format(line))
+					self.poutput('*** Error: {}'.format(err))
+					self._status = 1
+			self.postloop()
+		finally:
+			self.flush()
+			self._chan.send_exit_status(self._status)
+		return self._status
 
 	def default(self, line):
 		"""Called on an input line when the command prefix is not recognized"""
 		self.poutput('*** Unknown syntax: {}'.format(line))
+		self._status = 1
 
 	def get_names(self):
 		return [n for n in dir(self.__class__) if n not in self.hidden_cmds]
@@ -480,6 +1421,7 @@ class SSHCmd(cmd.Cmd):
 			nrows = len(list)
 			ncols = 1
 			colwidths = [0]
+		lines = []
 		for row in range(nrows):
 			texts = []
 			for col in range(ncols):
@@ -493,5 +1435,6 @@ class SSHCmd(cmd.Cmd):
 				del texts[-1]
 			for col in range(len(texts)):
 				texts[col] = texts[col].ljust(colwidths[col])
-			self.poutput('{}'.format(str("  ".join(texts))))
+			lines.append("  ".join(texts))
+		self.poutput(self.newline.join(lines))
 
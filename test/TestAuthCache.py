@@ -0,0 +1,69 @@
+import unittest
+from nerfzari.network import AuthCache
+
+#############
+### MOCKS ###
+#############
+
+class FakeClock(object):
+
+	def __init__(self):
+		self.now = 0.0
+
+	def __call__(self):
+		return self.now
+
+
+#############################
+### TEST CASE: Auth Cache ###
+#############################
+
+class TestAuthCache(unittest.TestCase):
+
+	def setUp(self):
+		self.clock = FakeClock()
+		self.cache = AuthCache(ttl=60, negative_ttl=10, max_size=2, clock=self.clock)
+	# --------------------------------------------------------------------------
+
+	def test_miss(self):
+		self.assertIsNone(self.cache.check('alice', 'secret'))
+	# --------------------------------------------------------------------------
+
+	def test_success_expires(self):
+		self.cache.store('alice', 'secret', True)
+		self.assertTrue(self.cache.check('alice', 'secret'))
+		self.assertIsNone(self.cache.check('alice', 'wrong'))
+		self.clock.now = 61
+		self.assertIsNone(self.cache.check('alice', 'secret'))
+	# --------------------------------------------------------------------------
+
+	def test_failure_expires_sooner(self):
+		self.cache.store('alice', 'wrong', False)
+		self.assertIs(self.cache.check('alice', 'wrong'), False)
+		# a failed attempt doesn't lock out the right password
+		self.assertIsNone(self.cache.check('alice', 'secret'))
+		self.clock.now = 11
+		self.assertIsNone(self.cache.check('alice', 'wrong'))
+	# --------------------------------------------------------------------------
+
+	def test_lru_eviction(self):
+		self.cache.store('alice', 'a', True)
+		self.cache.store('bob', 'b', True)
+		self.assertTrue(self.cache.check('alice', 'a'))
+		self.cache.store('carol', 'c', True)
+		self.assertTrue(self.cache.check('alice', 'a'))
+		self.assertIsNone(self.cache.check('bob', 'b'))
+		self.assertTrue(self.cache.check('carol', 'c'))
+	# --------------------------------------------------------------------------
+
+	def test_password_not_stored(self):
+		self.cache.store('alice', 'secret', True)
+		self.assertNotIn(b'secret', repr(self.cache.__dict__).encode())
+
+
+############
+### MAIN ###
+############
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
@@ -0,0 +1,137 @@
+import os
+import sys
+import threading
+import unittest
+import ldap3
+from nerfzari import AuthCache
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules', 'auth'))
+from ldapauth import LDAPAuthenticator, LDAPConnectionPool
+
+ALICE = 'cn=alice,ou=test'
+
+#############
+### MOCKS ###
+#############
+
+class MockLDAPAuthenticator(LDAPAuthenticator):
+	"""Talks to ldap3's in-memory mock directory and counts the connections it makes."""
+	client_strategy = ldap3.MOCK_SYNC
+
+	def __init__(self, *args, **kwargs):
+		super().__init__('mock', *args, **kwargs)
+		self.connections = 0
+		self.binds = 0
+		self._new_connection().strategy.add_entry(ALICE, {'userPassword': 'secret', 'sn': 'alice'})
+
+	def _new_connection(self, username=None, password=None):
+		self.connections = getattr(self, 'connections', 0) + 1
+		return super()._new_connection(username, password)
+
+	def _ldap_authenticate(self, username, password):
+		self.binds += 1
+		return super()._ldap_authenticate(username, password)
+# ------------------------------------------------------------------------------
+
+class FakeConnection(object):
+
+	def __init__(self):
+		self.closed = False
+
+	def unbind(self):
+		self.closed = True
+
+
+##################################
+### TEST CASE: Connection Pool ###
+##################################
+
+class TestLDAPConnectionPool(unittest.TestCase):
+
+	def setUp(self):
+		self.now = 0
+		self.pool = LDAPConnectionPool(FakeConnection, size=1, idle_timeout=10, clock=lambda: self.now)
+	# --------------------------------------------------------------------------
+
+	def test_reuse(self):
+		conn = self.pool.acquire()
+		self.pool.release(conn)
+		self.assertIs(self.pool.acquire(), conn)
+	# --------------------------------------------------------------------------
+
+	def test_size_limit(self):
+		pool = LDAPConnectionPool(FakeConnection, size=1, timeout=0)
+		first = pool.acquire()
+		self.assertIsNone(pool.acquire())
+		self.assertEqual(pool.open, 1)
+		pool.release(first, reuse=False)
+		self.assertTrue(first.closed)
+		self.assertIsNotNone(pool.acquire())
+		self.assertEqual(pool.open, 1)
+	# --------------------------------------------------------------------------
+
+	def test_waits_for_release(self):
+		pool = LDAPConnectionPool(FakeConnection, size=1, timeout=5)
+		conn = pool.acquire()
+		timer = threading.Timer(0.1, pool.release, (conn,))
+		timer.start()
+		self.assertIs(pool.acquire(), conn)
+		timer.join()
+	# --------------------------------------------------------------------------
+
+	def test_idle_timeout(self):
+		conn = self.pool.acquire()
+		self.pool.release(conn)
+		self.now = 11
+		self.assertIsNot(self.pool.acquire(), conn)
+		self.assertTrue(conn.closed)
+
+
+#####################################
+### TEST CASE: LDAP Authenticator ###
+#####################################
+
+class TestLDAPAuthenticator(unittest.TestCase):
+
+	def test_unpooled(self):
+		auth = MockLDAPAuthenticator()
+		self.assertTrue(auth.authenticate(ALICE, 'secret'))
+		self.assertFalse(auth.authenticate(ALICE, 'wrong'))
+		self.assertEqual(auth.err_msg, 'invalidCredentials')
+	# --------------------------------------------------------------------------
+
+	def test_pooled(self):
+		auth = MockLDAPAuthenticator(pool_size=2)
+		connections = auth.connections
+		for _ in range(3):
+			self.assertTrue(auth.authenticate(ALICE, 'secret'))
+			self.assertFalse(auth.authenticate(ALICE, 'wrong'))
+		self.assertEqual(auth.connections, connections + 1)
+	# --------------------------------------------------------------------------
+
+	def test_cached(self):
+		auth = MockLDAPAuthenticator(cache=AuthCache())
+		for _ in range(3):
+			self.assertTrue(auth.authenticate(ALICE, 'secret'))
+			self.assertFalse(auth.authenticate(ALICE, 'wrong'))
+		self.assertEqual(auth.binds, 2)
+	# --------------------------------------------------------------------------
+
+	def test_schema_read_once(self):
+		auth = MockLDAPAuthenticator(pool_size=1)
+		server = auth._ldap_server
+		reads = []
+		get_info = server.get_info_from_server
+		server.get_info_from_server = lambda conn: reads.append(conn) or get_info(conn)
+		auth.prepare()
+		for _ in range(3):
+			self.assertTrue(auth.authenticate(ALICE, 'secret'))
+		self.assertEqual(len(reads), 1)
+
+
+############
+### MAIN ###
+############
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
@@ -0,0 +1,660 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import unittest
+import peewee
+from datetime import datetime, timedelta
+from playhouse.migrate import SchemaMigrator, migrate
+import playhouse.pool
+from nerfzari.game import MODELS, DB_PRAGMAS, init_db, connect_db, close_db, database, GameEngine, User, GameMeta, GameBase, PlayerMeta, PlayerBase, UserStats, Assassin, AssassinPlayer
+from nerfzari.game.models import game_registry, player_registry, schedule_listeners
+from nerfzari.game.schema import upgrade
+from nerfzari.game.username import username_count
+
+#############
+### MOCKS ###
+#############
+
+class CountingDatabase(peewee.SqliteDatabase):
+	"""Counts the statements it runs."""
+	queries = 0
+
+	def execute_sql(self, sql, params=None, *args, **kwargs):
+		self.queries += 1
+		return super().execute_sql(sql, params, *args, **kwargs)
+# ------------------------------------------------------------------------------
+
+class DBTestCase(unittest.TestCase):
+	"""Runs each test against its own in-memory database."""
+
+	def setUp(self):
+		self.db = CountingDatabase(':memory:')
+		ctx = self.db.bind_ctx(MODELS)
+		ctx.__enter__()
+		self.addCleanup(ctx.__exit__, None, None, None)
+		self.db.create_tables(MODELS)
+		self.creator = User.new_user('creator', 'Creator', 'creator@example.com')
+	# --------------------------------------------------------------------------
+
+	def new_game(self, players, name='game', start_date=None, end_date=None):
+		if start_date is None:
+			start_date = datetime.now()
+		meta = GameMeta.new_game(start_date, 'assassin', name, self.creator, end_date)
+		for idx in range(players):
+			user = User.new_user('{}{}'.format(name, idx), 'Player', 'player@example.com')
+			PlayerMeta.new_player(user, meta)
+		return meta
+
+
+################################
+### TEST CASE: Type Registry ###
+################################
+
+class TestTypeRegistry(unittest.TestCase):
+
+	def test_lookups(self):
+		self.assertIs(game_registry.by_name('Assassin'), Assassin)
+		self.assertIs(player_registry.by_type('Assassin'), AssassinPlayer)
+		self.assertIs(player_registry.by_name('AssassinPlayer'), AssassinPlayer)
+		self.assertIsNone(player_registry.by_type('Tag'))
+		self.assertIn('Assassin', GameMeta.game_types())
+	# --------------------------------------------------------------------------
+
+	def test_new_types_register(self):
+		class Sardines(GameBase):
+			pass
+
+		class SardinesPlayer(PlayerBase):
+			FOR_GAMETYPE = 'Sardines'
+
+		self.addCleanup(game_registry.unregister, Sardines)
+		self.addCleanup(player_registry.unregister, SardinesPlayer)
+		self.assertIs(game_registry.by_type('Sardines'), Sardines)
+		self.assertIs(player_registry.by_type('Sardines'), SardinesPlayer)
+	# --------------------------------------------------------------------------
+
+	def test_unregister(self):
+		class Sardines(GameBase):
+			pass
+
+		game_registry.unregister(Sardines)
+		self.assertNotIn('Sardines', game_registry)
+		self.assertIsNone(game_registry.by_type('Sardines'))
+		self.assertNotIn('Sardines', GameMeta.game_types())
+		self.assertIs(game_registry.by_type('Assassin'), Assassin)
+
+
+#################################
+### TEST CASE: Tag Allocation ###
+#################################
+
+class TestTagAllocation(DBTestCase):
+
+	def test_distinct_and_free(self):
+		meta = self.new_game(20)
+		existing = set(x.tag for x in meta.players)
+		self.assertEqual(len(existing), 20)
+		tags = PlayerMeta.allocate_tags(200, rng=random.Random(1))
+		self.assertEqual(len(set(tags)), 200)
+		self.assertFalse(existing & set(tags))
+	# --------------------------------------------------------------------------
+
+	def test_collisions_are_redrawn(self):
+		# a space of a handful of tags, most of them already taken
+		space = username_count(2, 1)
+		tags = PlayerMeta.allocate_tags(space - 2, 2, 1)
+		meta = self.new_game(0)
+		for idx, tag in enumerate(tags):
+			user = User.new_user('p{}'.format(idx), 'Player', 'player@example.com')
+			PlayerMeta.new_player(user, meta, tag)
+		self.assertEqual(PlayerMeta.tag_capacity(2, 1), 2)
+		self.assertEqual(len(set(PlayerMeta.allocate_tags(2, 2, 1)) - set(tags)), 2)
+		self.assertRaises(RuntimeError, PlayerMeta.allocate_tags, 3, 2, 1)
+	# --------------------------------------------------------------------------
+
+	def test_taken_tag_is_redrawn(self):
+		meta = self.new_game(1)
+		taken = meta.players[0].tag
+		allocate = PlayerMeta.allocate_tags
+		calls = []
+		def racing(n, *args, **kwargs):
+			calls.append(n)
+			# the first pick loses a race with the player already holding it
+			if len(calls) == 1:
+				return [taken]
+			return allocate(n, *args, **kwargs)
+		PlayerMeta.allocate_tags = staticmethod(racing)
+		self.addCleanup(setattr, PlayerMeta, 'allocate_tags', staticmethod(allocate))
+		user = User.new_user('late', 'Player', 'player@example.com')
+		player = PlayerMeta.new_player(user, meta)
+		self.assertEqual(len(calls), 2)
+		self.assertNotEqual(player.tag, taken)
+		self.assertEqual(GameMeta.get_by_id(meta.primary_key).alive, 2)
+		self.assertEqual(UserStats.for_user(user).games_played, 1)
+		self.assertFalse(meta.game.reset_tag(user, taken))
+		self.assertEqual(meta.game.tag(user), player.tag)
+		other = User.new_user('other', 'Player', 'player@example.com')
+		self.assertRaises(peewee.IntegrityError, PlayerMeta.new_player, other, meta, taken)
+
+
+###########################
+### TEST CASE: Assassin ###
+###########################
+
+class TestAssassin(DBTestCase):
+
+	def test_start_ring(self):
+		meta = self.new_game(200)
+		other = self.new_game(3, 'other')
+		meta.game.start()
+		players = (AssassinPlayer
+			.select()
+			.join(PlayerMeta, on=(AssassinPlayer.meta == PlayerMeta.primary_key))
+			.where(PlayerMeta.game == meta)
+		)
+		targets = { x.meta_id: x.target_id for x in players }
+		self.assertEqual(len(targets), 200)
+		# following the targets from anyone visits every player once
+		start = next(iter(targets))
+		seen = [start]
+		while targets[seen[-1]] != start:
+			seen.append(targets[seen[-1]])
+		self.assertEqual(sorted(seen), sorted(targets))
+		self.assertEqual(AssassinPlayer.select().where(AssassinPlayer.target.is_null()).count(), 3)
+	# --------------------------------------------------------------------------
+
+	def test_last_player_wins(self):
+		meta = self.new_game(3)
+		self.new_game(2, 'other')
+		first, second, third = list(meta.players)
+		self.assertEqual(meta.alive, 3)
+		self.assertEqual(meta.game.eliminate(first, second), 2)
+		self.assertRaises(RuntimeError, meta.game.eliminate, second, third)
+		self.assertFalse(GameMeta.get_by_id(meta.primary_key).over)
+		self.assertEqual(meta.game.eliminate(third, first), 1)
+		meta = GameMeta.get_by_id(meta.primary_key)
+		self.assertTrue(meta.over)
+		self.assertEqual(meta.alive, 1)
+		self.assertEqual(meta.game.winner_id, third.primary_key)
+	# --------------------------------------------------------------------------
+
+	def test_eliminate_by_tag(self):
+		meta = self.new_game(3)
+		other = self.new_game(1, 'other')
+		first, second, third = [PlayerMeta.get(user=User.get(user_name='game{}'.format(x))) for x in range(3)]
+		self.assertEqual(meta.game.eliminate_by_tag(first.user, second.tag), 2)
+		self.assertRaises(RuntimeError, meta.game.eliminate_by_tag, first.user, second.tag)
+		self.assertRaises(RuntimeError, meta.game.eliminate_by_tag, second.user, third.tag)
+		self.assertRaises(RuntimeError, meta.game.eliminate_by_tag, first.user, other.players[0].tag)
+		self.assertRaises(RuntimeError, meta.game.eliminate_by_tag, first.user, first.tag)
+		self.assertEqual(PlayerMeta.get_by_id(second.primary_key).eliminated_by_id, first.primary_key)
+	# --------------------------------------------------------------------------
+
+	def race(self, meta, reports):
+		"""Runs each (player, target) report on its own thread at once."""
+		barrier = threading.Barrier(len(reports))
+		results = [None] * len(reports)
+		def report(idx, player, target):
+			barrier.wait()
+			try:
+				results[idx] = meta.game.eliminate(player, target)
+			except RuntimeError:
+				results[idx] = 'lost'
+			finally:
+				self.db.close()
+		threads = [threading.Thread(target=report, args=(idx,) + x) for idx, x in enumerate(reports)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		return results
+	# --------------------------------------------------------------------------
+
+	def test_concurrent_eliminations(self):
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.db = connect_db(os.path.join(tmp.name, 'race.sqlite'))
+		ctx = self.db.bind_ctx(MODELS)
+		ctx.__enter__()
+		self.addCleanup(ctx.__exit__, None, None, None)
+		self.db.create_tables(MODELS)
+		self.creator = User.new_user('creator', 'Creator', 'creator@example.com')
+		meta = self.new_game(8)
+		players = list(PlayerMeta.select().where(PlayerMeta.game == meta))
+		# everyone reports the same target at once
+		results = self.race(meta, [(x, players[0]) for x in players[1:]])
+		self.assertEqual(sorted(results, key=str), [7] + ['lost'] * 6)
+		# two players report each other at once
+		results = self.race(meta, [(players[1], players[2]), (players[2], players[1])])
+		self.assertEqual(sorted(results, key=str), [6, 'lost'])
+		self.assertEqual(GameMeta.get_by_id(meta.primary_key).alive, 6)
+		self.assertEqual(PlayerMeta.select().where(PlayerMeta.eliminated_by.is_null()).count(), 6)
+		self.assertEqual(sum(x.kills for x in UserStats.select()), 2)
+		self.db.close()
+	# --------------------------------------------------------------------------
+
+	def ring(self, meta):
+		"""Returns the users in the order they hunt each other."""
+		order = [next(iter(meta.players)).user]
+		while True:
+			user = meta.game.target(order[-1])
+			if user == order[0]:
+				return order
+			order.append(user)
+	# --------------------------------------------------------------------------
+
+	def test_target_inherited(self):
+		meta = self.new_game(4)
+		meta.game.start()
+		first, second, third, fourth = self.ring(meta)
+		players = { x.user_id: x for x in meta.players }
+		meta.game.eliminate(players[first.primary_key], players[second.primary_key])
+		self.assertEqual(meta.game.target(first), third)
+		self.assertIsNone(meta.game.target(second))
+		# eliminating your own hunter passes you on to their hunter
+		meta.game.eliminate(players[first.primary_key], players[fourth.primary_key])
+		self.assertEqual(meta.game.target(third), first)
+		self.assertEqual(self.ring(meta), [first, third])
+
+
+#######################
+### TEST CASE: User ###
+#######################
+
+class TestUser(DBTestCase):
+
+	def assertQueries(self, count, func, *args):
+		"""Calls func and checks that it ran count statements."""
+		before = self.db.queries
+		ret = func(*args)
+		self.assertEqual(self.db.queries - before, count)
+		return ret
+	# --------------------------------------------------------------------------
+
+	def test_records(self):
+		first = self.new_game(3, 'a')
+		second = self.new_game(0, 'b')
+		a0, a1, a2 = [User.get(user_name='a{}'.format(x)) for x in range(3)]
+		player = lambda user, meta: PlayerMeta.get(user=user, game=meta)
+		first.game.eliminate(player(a0, first), player(a1, first))
+		PlayerMeta.new_player(a0, second)
+		PlayerMeta.new_player(a1, second)
+		second.game.eliminate(player(a1, second), player(a0, second))
+		self.assertEqual([self.assertQueries(1, x.kills) for x in (a0, a1, a2)], [1, 1, 0])
+		self.assertEqual([self.assertQueries(1, x.deaths) for x in (a0, a1, a2)], [1, 1, 0])
+		self.assertTrue(self.assertQueries(1, a2.has_joined, 'a'))
+		self.assertFalse(self.assertQueries(1, a2.has_joined, 'b'))
+		self.assertEqual(
+			sorted(self.assertQueries(1, a0.games_joined)),
+			sorted([first.primary_key, second.primary_key])
+		)
+	# --------------------------------------------------------------------------
+
+	def test_list_games(self):
+		self.new_game(0, 'first')
+		self.new_game(0, 'second')
+		before = self.db.queries
+		names = [x.creator.user_name for x in GameMeta.list_games()]
+		self.assertEqual(self.db.queries - before, 1)
+		self.assertEqual(names, ['creator', 'creator'])
+
+
+#############################
+### TEST CASE: User Stats ###
+#############################
+
+class TestUserStats(DBTestCase):
+
+	def play(self):
+		"""a0 eliminates a1 and a2 to win, a1 leaves a second game."""
+		meta = self.new_game(3, 'a')
+		a0, a1, a2 = [User.get(user_name='a{}'.format(x)) for x in range(3)]
+		player = lambda user: PlayerMeta.get(user=user, game=meta)
+		meta.game.eliminate(player(a0), player(a1))
+		meta.game.eliminate(player(a0), player(a2))
+		other = GameMeta.new_game(datetime.now(), 'assassin', 'b', self.creator)
+		PlayerMeta.new_player(a1, other).safe_delete()
+		return a0, a1, a2
+	# --------------------------------------------------------------------------
+
+	def totals(self):
+		"""Users with anything counted, a missing row counts nothing."""
+		return sorted(
+			(x.user.user_name, x.kills, x.deaths, x.games_played, x.wins)
+			for x in UserStats.select(UserStats, User).join(User)
+			if x.kills or x.deaths or x.games_played or x.wins
+		)
+	# --------------------------------------------------------------------------
+
+	def test_incremental(self):
+		a0, a1, a2 = self.play()
+		self.assertEqual(self.totals(), [
+			('a0', 2, 0, 1, 1),
+			('a1', 0, 1, 1, 0),
+			('a2', 0, 1, 1, 0)
+		])
+		stats = UserStats.for_user(a0)
+		self.assertEqual((stats.streak, stats.best_streak, stats.rank()), (2, 2, 1))
+		self.assertEqual(UserStats.for_user(a2).rank(), 2)
+		self.assertEqual(UserStats.for_user(self.creator).kills, 0)
+	# --------------------------------------------------------------------------
+
+	def test_rebuild_matches(self):
+		self.play()
+		before = self.totals()
+		UserStats.rebuild()
+		self.assertEqual(self.totals(), before)
+	# --------------------------------------------------------------------------
+
+	def test_delete_game(self):
+		a0, _, _ = self.play()
+		GameMeta.get(name='a').safe_delete()
+		self.assertEqual(self.totals(), [])
+		self.assertEqual(UserStats.for_user(a0).best_streak, 2)
+		UserStats.rebuild()
+		self.assertEqual(self.totals(), [])
+	# --------------------------------------------------------------------------
+
+	def test_delete_eliminated_player(self):
+		a0, a1, _ = self.play()
+		meta = GameMeta.get(name='a')
+		PlayerMeta.get(user=a1, game=meta).safe_delete()
+		self.assertEqual(self.totals(), [
+			('a0', 1, 0, 1, 1),
+			('a2', 0, 1, 1, 0)
+		])
+		self.assertEqual(PlayerMeta.get(user=a0, game=meta).kill_count, 1)
+		self.assertEqual(UserStats.for_user(a0).streak, 2)
+		before = self.totals()
+		UserStats.rebuild()
+		self.assertEqual(self.totals(), before)
+	# --------------------------------------------------------------------------
+
+	def test_delete_with_foreign_keys(self):
+		self.db.execute_sql('PRAGMA foreign_keys = 1')
+		meta = self.new_game(3, 'a')
+		meta.game.start()
+		a0, a1, a2 = [PlayerMeta.get(user=User.get(user_name='a{}'.format(x)), game=meta) for x in range(3)]
+		meta.game.eliminate(a0, a1)
+		meta.game.eliminate(a0, a2)
+		# the winner, who eliminated the others, leaves the finished game
+		PlayerMeta.get_by_id(a0.primary_key).safe_delete()
+		meta = GameMeta.get_by_id(meta.primary_key)
+		self.assertIsNone(meta.game.winner_id)
+		self.assertEqual(meta.alive, 2)
+		self.assertEqual(PlayerMeta.select().where(PlayerMeta.eliminated_by.is_null(False)).count(), 0)
+		self.assertEqual(self.totals(), [('a1', 0, 0, 1, 0), ('a2', 0, 0, 1, 0)])
+		meta.safe_delete()
+		self.assertEqual(PlayerMeta.select().count(), 0)
+		self.assertEqual(AssassinPlayer.select().count(), 0)
+		self.assertEqual(Assassin.select().count(), 0)
+		self.assertEqual(self.totals(), [])
+	# --------------------------------------------------------------------------
+
+	def test_game_stats(self):
+		a0, a1, _ = self.play()
+		meta = self.new_game(0, 'c')
+		PlayerMeta.new_player(a1, meta)
+		self.assertEqual([(x.game.name, x.kill_count) for x in a0.game_stats()], [('a', 2)])
+		self.assertEqual([x.game.name for x in a1.game_stats('a')], ['a'])
+		self.assertEqual(len(a1.game_stats()), 2)
+		self.assertEqual(len(a0.game_stats('c')), 0)
+	# --------------------------------------------------------------------------
+
+	def test_leaderboard(self):
+		self.play()
+		self.assertEqual([x.user.user_name for x in UserStats.leaderboard(2)], ['a0', 'a1'])
+		sql, params = UserStats.leaderboard().sql()
+		plan = ' '.join(x[3] for x in self.db.execute_sql('EXPLAIN QUERY PLAN ' + sql, params))
+		self.assertNotIn('TEMP B-TREE', plan)
+	# --------------------------------------------------------------------------
+
+	def test_upgrade_creates_table(self):
+		self.play()
+		self.db.drop_tables([UserStats])
+		self.assertEqual(upgrade(MODELS), [])
+		self.assertEqual(UserStats.for_user(User.get(user_name='a0')).wins, 1)
+
+
+##############################
+### TEST CASE: Game Engine ###
+##############################
+
+class TestGameEngine(DBTestCase):
+
+	def setUp(self):
+		super().setUp()
+		self.now = datetime(2020, 6, 1, 12)
+		self.engine = GameEngine(clock=lambda: self.now, resync=None)
+		self.addCleanup(self.engine.close)
+		schedule_listeners.append(self.engine.notify)
+		self.addCleanup(schedule_listeners.remove, self.engine.notify)
+	# --------------------------------------------------------------------------
+
+	def sleep(self):
+		"""Runs the engine and lets the clock run to its next deadline, as run() would."""
+		delay = self.engine.step()
+		if delay is not None:
+			self.now += timedelta(seconds=delay)
+		return delay
+	# --------------------------------------------------------------------------
+
+	def fresh(self, meta):
+		return GameMeta.get_by_id(meta.primary_key)
+	# --------------------------------------------------------------------------
+
+	def test_starts_on_time(self):
+		later = self.new_game(3, 'later', self.now + timedelta(hours=2))
+		sooner = self.new_game(3, 'sooner', self.now + timedelta(minutes=30), self.now + timedelta(hours=3))
+		self.assertEqual(self.sleep(), 30 * 60)
+		self.assertFalse(self.fresh(sooner).started)
+		self.assertEqual(self.sleep(), 90 * 60)
+		self.assertTrue(self.fresh(sooner).started)
+		self.assertFalse(self.fresh(later).started)
+		self.assertEqual(self.sleep(), 60 * 60)
+		self.assertTrue(self.fresh(later).started)
+		self.assertFalse(self.fresh(sooner).over)
+		self.assertIsNone(self.sleep())
+		self.assertTrue(self.fresh(sooner).over)
+		self.assertEqual(AssassinPlayer.select().where(AssassinPlayer.target.is_null()).count(), 0)
+	# --------------------------------------------------------------------------
+
+	def test_woken_by_schedule_changes(self):
+		first = self.new_game(2, 'first', self.now + timedelta(hours=1))
+		self.assertEqual(self.engine.step(), 60 * 60)
+		self.assertFalse(self.engine.wait_for_change(0))
+		second = self.new_game(2, 'second', self.now + timedelta(minutes=1))
+		self.assertTrue(self.engine.wait_for_change(0))
+		self.assertEqual(self.engine.step(), 60)
+		second.safe_delete()
+		self.assertEqual(self.engine.step(), 60 * 60)
+		# overdue games start right away
+		self.now += timedelta(hours=2)
+		self.assertIsNone(self.engine.step())
+		self.assertTrue(self.fresh(first).started)
+	# --------------------------------------------------------------------------
+
+	def test_woken_by_other_processes(self):
+		self.assertIsNone(self.engine.step())
+		# made as if by a session worker, which only has the listener it inherited
+		schedule_listeners.remove(self.engine.notify)
+		self.addCleanup(schedule_listeners.append, self.engine.notify)
+		meta = self.new_game(2, 'forked', self.now + timedelta(minutes=5))
+		child = multiprocessing.get_context('fork').Process(target=self.engine.notify, args=(meta.primary_key,))
+		child.start()
+		child.join()
+		self.assertTrue(self.engine.wait_for_change(5))
+		self.assertEqual(self.engine.step(), 5 * 60)
+	# --------------------------------------------------------------------------
+
+	def test_run_closes_pipe(self):
+		class IdleEngine(GameEngine):
+			def step(self):
+				return None # nothing scheduled, sleep until woken
+		engine = IdleEngine()
+		fds = [engine._wake_r, engine._wake_w]
+		engine.start()
+		engine.stop()
+		engine.join(5)
+		self.assertFalse(engine.is_alive())
+		for fd in fds:
+			self.assertRaises(OSError, os.fstat, fd)
+		# late notifies and stops are dropped
+		engine.notify(self.creator.primary_key)
+		engine.stop()
+		engine.close()
+	# --------------------------------------------------------------------------
+
+	def test_workers(self):
+		# worker threads need a database they can all open
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		db = connect_db(os.path.join(tmp.name, 'engine.sqlite'))
+		ctx = db.bind_ctx(MODELS)
+		ctx.__enter__()
+		self.addCleanup(ctx.__exit__, None, None, None)
+		db.create_tables(MODELS)
+		self.creator = User.new_user('creator', 'Creator', 'creator@example.com')
+		ran = []
+		class RecordingEngine(GameEngine):
+			def _fire(self, meta_id, action):
+				ran.append((meta_id, action, threading.current_thread().name))
+				super()._fire(meta_id, action)
+		engine = RecordingEngine(clock=lambda: self.now, resync=None, workers=3)
+		self.addCleanup(engine.close)
+		metas = [self.new_game(2, 'g{}'.format(x), self.now, self.now) for x in range(12)]
+		engine.step()
+		depths = engine.queue_depths()
+		self.assertEqual((len(depths), sum(depths)), (3, 24))
+		engine.start_workers()
+		engine.stop_workers()
+		self.assertEqual(engine.queue_depths(), [0, 0, 0])
+		for meta in metas:
+			actions = [(x[1], x[2]) for x in ran if x[0] == meta.primary_key]
+			# started then ended, both by the one worker that owns the game
+			self.assertEqual([x[0] for x in actions], ['start', 'end'])
+			self.assertEqual(actions[0][1], actions[1][1])
+			meta = self.fresh(meta)
+			self.assertTrue(meta.started and meta.over)
+		db.close()
+	# --------------------------------------------------------------------------
+
+	def test_resync(self):
+		self.engine = GameEngine(clock=lambda: self.now, resync=60)
+		self.addCleanup(self.engine.close)
+		self.assertEqual(self.engine.step(), 60)
+		meta = self.new_game(2, 'unnoticed', self.now)
+		self.now += timedelta(seconds=60)
+		self.engine.step()
+		self.assertTrue(self.fresh(meta).started)
+
+
+#########################
+### TEST CASE: Schema ###
+#########################
+
+class TestSchema(DBTestCase):
+
+	def query_plan(self, query):
+		sql, params = query.sql()
+		return ' '.join(x[3] for x in self.db.execute_sql('EXPLAIN QUERY PLAN ' + sql, params))
+	# --------------------------------------------------------------------------
+
+	def test_hot_queries_use_indexes(self):
+		meta = self.new_game(2)
+		user = meta.players[0].user
+		queries = [
+			PlayerMeta.select().where((PlayerMeta.user == user) & (PlayerMeta.game == meta)),
+			PlayerMeta.select().where((PlayerMeta.game == meta) & PlayerMeta.eliminated_by.is_null()),
+			PlayerMeta.select().where(PlayerMeta.tag == 'someTag'),
+			GameMeta.active_games()
+		]
+		for query in queries:
+			plan = self.query_plan(query)
+			self.assertIn('USING', plan)
+			self.assertNotIn('SCAN', plan)
+	# --------------------------------------------------------------------------
+
+	def test_upgrade(self):
+		meta = self.new_game(3)
+		first, second, _ = list(meta.players)
+		meta.game.eliminate(first, second)
+		migrator = SchemaMigrator.from_database(self.db)
+		migrate(
+			migrator.drop_index('gamemeta', 'gamemeta_over_start_date'),
+			migrator.drop_column('gamemeta', 'alive')
+		)
+		self.assertEqual(upgrade(MODELS), [('gamemeta', 'alive')])
+		self.assertEqual(GameMeta.get_by_id(meta.primary_key).alive, 2)
+		self.assertIn('gamemeta_over_start_date', [x.name for x in self.db.get_indexes('gamemeta')])
+		self.assertEqual(upgrade(MODELS), [])
+
+
+##########################
+### TEST CASE: Init DB ###
+##########################
+
+class TestInitDB(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+	# --------------------------------------------------------------------------
+
+	def tearDown(self):
+		close_db()
+		database.initialize(None)
+		self.tmp.cleanup()
+	# --------------------------------------------------------------------------
+
+	def pragma(self, name):
+		return database.execute_sql('PRAGMA {}'.format(name)).fetchone()[0]
+	# --------------------------------------------------------------------------
+
+	def test_pragmas(self):
+		init_db(os.path.join(self.tmp.name, 'nerfzari.sqlite'), dict(DB_PRAGMAS, cache_size=-2000))
+		self.assertEqual(self.pragma('journal_mode'), 'wal')
+		self.assertEqual(self.pragma('busy_timeout'), 5000)
+		self.assertEqual(self.pragma('cache_size'), -2000)
+		self.assertTrue(GameMeta.table_exists())
+	# --------------------------------------------------------------------------
+
+	def test_url(self):
+		init_db(url='sqlite:///:memory:')
+		creator = User.new_user('creator', 'Creator', 'creator@example.com')
+		meta = GameMeta.new_game(datetime.now(), 'assassin', 'game', creator)
+		PlayerMeta.new_player(creator, meta)
+		self.assertEqual(meta.game.join(creator).tag, meta.players[0].tag)
+		self.assertEqual(self.pragma('temp_store'), 2) # memory
+	# --------------------------------------------------------------------------
+
+	def test_pool(self):
+		init_db(os.path.join(self.tmp.name, 'nerfzari.sqlite'), pool_size=2)
+		self.assertIsInstance(database.obj, playhouse.pool.PooledSqliteDatabase)
+		self.assertEqual(self.pragma('journal_mode'), 'wal')
+		conn = database.connection()
+		database.close()
+		self.assertIs(database.connection(), conn)
+	# --------------------------------------------------------------------------
+
+	def test_pool_url(self):
+		init_db(url='sqlite+pool:///' + os.path.join(self.tmp.name, 'nerfzari.sqlite'))
+		self.assertIsInstance(database.obj, playhouse.pool.PooledSqliteDatabase)
+		database.close()
+		results = []
+		def query(): # gets the connection this thread opened
+			with database.connection_context():
+				results.append(GameMeta.select().count())
+		thread = threading.Thread(target=query)
+		thread.start()
+		thread.join()
+		self.assertEqual(results, [0])
+
+
+############
+### MAIN ###
+############
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
@@ -0,0 +1,121 @@
+import importlib.util
+import os
+import queue
+import tempfile
+import threading
+import time
+import unittest
+from nerfzari.game import User, init_db, close_db, database
+
+# the server script shares its name with the package, load it by path
+_spec = importlib.util.spec_from_file_location('nerfzari_server',
+	os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'nerfzari.py'))
+server = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(server)
+
+#############
+### MOCKS ###
+#############
+
+class WaitingChannel(object):
+	"""A channel whose reads block until the test feeds them."""
+
+	def __init__(self, reads):
+		self.reads = queue.Queue()
+		for data in reads:
+			self.reads.put(data)
+		self.sent = []
+
+	def recv(self, size):
+		return self.reads.get()
+
+	def sendall(self, data):
+		self.sent.append(data)
+
+	def waiting_at(self, prompt):
+		return len(self.sent) > 0 and self.sent[-1].endswith(prompt.encode('utf-8'))
+
+
+##################################
+### TEST CASE: Pooled Sessions ###
+##################################
+
+class TestPooledSessions(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		init_db(os.path.join(self.tmp.name, 'nerfzari.sqlite'), pool_size=2, pool_timeout=2)
+		close_db() # as the server does before taking sessions
+	# --------------------------------------------------------------------------
+
+	def tearDown(self):
+		close_db()
+		database.initialize(None)
+		self.tmp.cleanup()
+	# --------------------------------------------------------------------------
+
+	def wait_for(self, cond):
+		deadline = time.monotonic() + 5
+		while not cond():
+			self.assertLess(time.monotonic(), deadline)
+			time.sleep(0.01)
+	# --------------------------------------------------------------------------
+
+	def test_sessions_at_a_prompt_hold_no_connection(self):
+		errors = []
+		def session(chan, name):
+			try:
+				server.NerfzariCmd(chan, name).cmdloop()
+			except Exception as e:
+				errors.append(e)
+		chans = [WaitingChannel([]) for _ in range(4)]
+		threads = [threading.Thread(target=session, args=(x, 'user{}'.format(idx))) for idx, x in enumerate(chans)]
+		for thread in threads:
+			thread.start()
+		# every session waits for registration details, then at the command prompt
+		self.wait_for(lambda: all(x.waiting_at('full name> ') for x in chans) or errors)
+		for chan in chans:
+			chan.reads.put(b'Player\remail\r')
+		self.wait_for(lambda: all(x.waiting_at('> ') for x in chans) or errors)
+		for chan in chans:
+			chan.reads.put(b'exit\r')
+		for thread in threads:
+			thread.join(5)
+		self.assertEqual(errors, [])
+		self.assertEqual(User.select().count(), 4)
+
+
+
+########################
+### TEST CASE: Table ###
+########################
+
+class TestDrawTable(unittest.TestCase):
+
+	def test_one_write(self):
+		chan = WaitingChannel([])
+		term = server.NerfzariCmd(chan, 'tester')
+		term.draw_table(['Name', 'Type'], [['first', 'assassin'], ['second', 'assassin']])
+		self.assertEqual(chan.sent, [])
+		term.flush()
+		self.assertEqual(len(chan.sent), 1)
+		self.assertIn(b'second', chan.sent[0])
+		self.assertTrue(chan.sent[0].endswith(b'\r\n'))
+	# --------------------------------------------------------------------------
+
+	def test_batch_tab_separated(self):
+		chan = WaitingChannel([])
+		term = server.NerfzariCmd(chan, 'tester')
+		term._batch = True # as batchloop sets it
+		term.newline = '\n'
+		term.draw_table(['Name', 'Kills'], [['first', 3], ['second', 0]])
+		term.flush()
+		self.assertEqual(b''.join(chan.sent), b'Name\tKills\nfirst\t3\nsecond\t0\n')
+
+
+############
+### MAIN ###
+############
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
@@ -0,0 +1,481 @@
+import os
+import signal
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import paramiko
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from nerfzari.network import AsyncSSHServer, Authenticator, HostKeyCache, KeyDecoder, SSHCmd, SSHInterface, SSHServer
+
+#############
+### MOCKS ###
+#############
+
+class FakeChannel(object):
+	"""Feeds canned reads to a session and records what it sends."""
+
+	def __init__(self, reads):
+		self.reads = list(reads)
+		self.sent = []
+		self.exit_status = None
+
+	def recv(self, size):
+		if self.reads:
+			return self.reads.pop(0)
+		return b''
+
+	def sendall(self, data):
+		self.sent.append(data)
+
+	def send_exit_status(self, status):
+		self.exit_status = status
+# ------------------------------------------------------------------------------
+
+class EchoCmd(SSHCmd):
+	prompt = '>'
+
+	def __init__(self, chan, user_name='tester'):
+		super().__init__(chan, user_name)
+		self.lines = []
+
+	def do_say(self, line):
+		self.lines.append(line)
+		self.poutput('said {}'.format(line))
+
+	def do_ask(self, line):
+		name = yield self.ask('name>')
+		self.lines.append(name)
+
+	def do_exit(self, line):
+		return True
+# ------------------------------------------------------------------------------
+
+class CountingAuth(Authenticator):
+	made = 0
+	prepared = 0
+
+	def __init__(self):
+		CountingAuth.made += 1
+
+	def prepare(self):
+		CountingAuth.prepared += 1
+
+	def authenticate(self, username, password):
+		return True
+# ------------------------------------------------------------------------------
+
+class ServerClient(object):
+	"""Connects paramiko clients to a test server listening on self.port."""
+
+	def connect(self):
+		client = paramiko.SSHClient()
+		client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+		self.addCleanup(client.close)
+		deadline = time.monotonic() + 5
+		while True: # until serve_forever is listening
+			try:
+				client.connect('127.0.0.1', self.port, username='tester', password='x',
+					look_for_keys=False, allow_agent=False, timeout=5)
+				return client
+			except paramiko.ssh_exception.NoValidConnectionsError:
+				self.assertLess(time.monotonic(), deadline)
+				time.sleep(0.01)
+
+	def read_until(self, chan, text):
+		chan.settimeout(5)
+		out = b''
+		while text not in out:
+			data = chan.recv(1024)
+			self.assertTrue(data, out)
+			out += data
+		return out
+
+
+##############################
+### TEST CASE: Key Decoder ###
+##############################
+
+class TestKeyDecoder(unittest.TestCase):
+
+	def setUp(self):
+		self.decoder = KeyDecoder()
+	# --------------------------------------------------------------------------
+
+	def test_every_key_in_one_read(self):
+		self.assertEqual(self.decoder.decode(b'ab\x1b[Ac\x7f'), ['a', 'b', '\x1b[A', 'c', '\x7f'])
+	# --------------------------------------------------------------------------
+
+	def test_split_utf8(self):
+		data = 'né'.encode('utf-8')
+		self.assertEqual(self.decoder.decode(data[:-1]), ['n'])
+		self.assertEqual(self.decoder.decode(data[-1:]), ['é'])
+	# --------------------------------------------------------------------------
+
+	def test_split_escape_sequence(self):
+		self.assertEqual(self.decoder.decode(b'x\x1b['), ['x'])
+		self.assertEqual(self.decoder.decode(b'3'), [])
+		self.assertEqual(self.decoder.decode(b'~y'), ['\x1b[3~', 'y'])
+	# --------------------------------------------------------------------------
+
+	def test_line_endings(self):
+		self.assertEqual(self.decoder.decode(b'a\r\nb\nc\r'), ['a', '\r', 'b', '\r', 'c', '\r'])
+		self.assertEqual(self.decoder.decode(b'\nd'), ['d'])
+
+
+##########################
+### TEST CASE: SSH Cmd ###
+##########################
+
+class TestSSHCmdInput(unittest.TestCase):
+
+	def run_session(self, reads):
+		chan = FakeChannel(reads)
+		term = EchoCmd(chan)
+		term.cmdloop()
+		return term, chan
+	# --------------------------------------------------------------------------
+
+	def test_pasted_commands(self):
+		term, chan = self.run_session([b'say hello\rsay world\rexit\r'])
+		self.assertEqual(term.lines, ['hello', 'world'])
+		# the first prompt, then the echo and replies for the whole paste in one write
+		self.assertEqual(len(chan.sent), 2)
+		self.assertIn(b'said world', chan.sent[1])
+	# --------------------------------------------------------------------------
+
+	def test_keystrokes(self):
+		reads = [bytes([x]) for x in b'say hx'] + [b'\x7f', b'i', b'\r', b'\x1b', b'[A', b'\r', b'exit\r']
+		term, _ = self.run_session(reads)
+		self.assertEqual(term.lines, ['hi', 'hi'])
+	# --------------------------------------------------------------------------
+
+	def test_closed_channel(self):
+		term, _ = self.run_session([b'say bye'])
+		self.assertEqual(term.lines, [])
+
+
+
+#########################
+### TEST CASE: Output ###
+#########################
+
+class TestSSHCmdOutput(unittest.TestCase):
+
+	def setUp(self):
+		self.chan = FakeChannel([])
+		self.term = EchoCmd(self.chan)
+	# --------------------------------------------------------------------------
+
+	def test_poutput_one_write(self):
+		self.term.poutput('first\r\nsecond')
+		self.term.poutput('third')
+		self.assertEqual(self.chan.sent, [])
+		self.term.flush()
+		self.assertEqual(self.chan.sent, [b'first\r\nsecond\r\nthird\r\n'])
+	# --------------------------------------------------------------------------
+
+	def test_columnize_one_write(self):
+		self.term.columnize(['word{}'.format(x) for x in range(40)])
+		self.assertEqual(self.chan.sent, [])
+		self.term.flush()
+		self.assertEqual(len(self.chan.sent), 1)
+		self.assertEqual(self.chan.sent[0].count(b'\r\n'), 4)
+	# --------------------------------------------------------------------------
+
+	def test_flushes_when_full(self):
+		self.term.max_buffer = 16
+		self.term.poutput('a' * 10)
+		self.assertEqual(self.chan.sent, [])
+		self.term.poutput('b' * 10)
+		self.assertEqual(self.chan.sent, [b'a' * 10 + b'\r\n' + b'b' * 10])
+		self.term.flush()
+		self.assertEqual(b''.join(self.chan.sent), b'a' * 10 + b'\r\n' + b'b' * 10 + b'\r\n')
+	# --------------------------------------------------------------------------
+
+	def test_buffer_counts_bytes(self):
+		self.term.max_buffer = 16
+		self.term.write('\u2500' * 5) # 15 bytes
+		self.assertEqual(self.chan.sent, [])
+		self.term.write('\u2500')
+		self.assertEqual(self.chan.sent, ['\u2500'.encode('utf-8') * 6])
+
+	# --------------------------------------------------------------------------
+
+	def test_packets_fit_the_client(self):
+		server_sock, client_sock = socket.socketpair()
+		server = paramiko.Transport(server_sock)
+		client = paramiko.Transport(client_sock)
+		self.addCleanup(client.close)
+		self.addCleanup(server.close)
+		server.add_server_key(paramiko.RSAKey.from_private_key_file(TestSSHServer.key_path))
+		server.start_server(threading.Event(), SSHInterface(CountingAuth())) # negotiates in the background
+		client.connect(username='tester', password='x')
+		client_chan = client.open_session()
+		chan = server.accept(5)
+		packets = []
+		send = server._send_user_message
+		server._send_user_message = lambda m: packets.append(len(m.asbytes())) or send(m)
+		term = EchoCmd(chan)
+		text = '\u2502' * 20000 # three bytes each, like tableprint's box lines
+		term.poutput(text)
+		term.flush()
+		received = b''
+		expected = (text + term.newline).encode('utf-8')
+		client_chan.settimeout(5)
+		while len(received) < len(expected):
+			received += client_chan.recv(65536)
+		self.assertEqual(received, expected)
+		self.assertLessEqual(max(packets), chan.out_max_packet_size)
+
+
+
+#############################
+### TEST CASE: Batch Mode ###
+#############################
+
+class TestSSHCmdBatch(unittest.TestCase):
+
+	def test_exec_command(self):
+		chan = FakeChannel([])
+		term = EchoCmd(chan)
+		self.assertEqual(term.batchloop('say a\nask\nbob\nsay b'), 0)
+		self.assertEqual(term.lines, ['a', 'bob', 'b'])
+		self.assertEqual(b''.join(chan.sent), b'said a\nsaid b\n')
+		self.assertEqual(chan.exit_status, 0)
+	# --------------------------------------------------------------------------
+
+	def test_batch_stream(self):
+		chan = FakeChannel([b'say a\nsa', b'y b\n', b'exit\nsay c\n'])
+		term = EchoCmd(chan)
+		term.batchloop('batch')
+		self.assertEqual(term.lines, ['a', 'b'])
+		self.assertEqual(chan.exit_status, 0)
+	# --------------------------------------------------------------------------
+
+	def test_unknown_command_fails(self):
+		chan = FakeChannel([])
+		term = EchoCmd(chan)
+		self.assertEqual(term.batchloop('say a\nshout b\nsay c'), 1)
+		self.assertEqual(term.lines, ['a', 'c'])
+		self.assertIn(b'*** Unknown syntax: shout b', b''.join(chan.sent))
+		self.assertEqual(chan.exit_status, 1)
+
+
+#################################
+### TEST CASE: Host Key Cache ###
+#################################
+
+class TestHostKeyCache(unittest.TestCase):
+
+	def setUp(self):
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.ecdsa_path = os.path.join(tmp.name, 'ecdsa.key')
+		self.ed25519_path = os.path.join(tmp.name, 'ed25519.key')
+		self.write_ecdsa(self.ecdsa_path)
+		self.write_ed25519(self.ed25519_path)
+
+	@staticmethod
+	def write_ecdsa(path):
+		key = paramiko.ECDSAKey.generate()
+		key.write_private_key_file(path)
+		return key
+
+	@staticmethod
+	def write_ed25519(path):
+		pem = ed25519.Ed25519PrivateKey.generate().private_bytes(serialization.Encoding.PEM,
+			serialization.PrivateFormat.OpenSSH, serialization.NoEncryption())
+		with open(path, 'wb') as key_file:
+			key_file.write(pem)
+		return paramiko.Ed25519Key(filename=path)
+
+	@staticmethod
+	def replace_key(path, write, mtime_step):
+		"""Writes a new key to path and moves its mtime by mtime_step seconds."""
+		stat = os.stat(path)
+		key = write(path)
+		os.utime(path, (stat.st_atime, stat.st_mtime + mtime_step))
+		return key
+	# --------------------------------------------------------------------------
+
+	def test_key_types(self):
+		cache = HostKeyCache([TestSSHServer.key_path, self.ecdsa_path, self.ed25519_path])
+		self.assertEqual([x.get_name() for x in cache.keys()], ['ssh-rsa', 'ecdsa-sha2-nistp256', 'ssh-ed25519'])
+		self.assertIs(cache.keys(), cache.keys())
+	# --------------------------------------------------------------------------
+
+	def test_reload_on_mtime(self):
+		for path, write in [(self.ecdsa_path, self.write_ecdsa), (self.ed25519_path, self.write_ed25519)]:
+			cache = HostKeyCache(path, check_mtime=True)
+			fixed = HostKeyCache(path)
+			old = cache.keys()[0]
+			self.assertEqual(fixed.keys()[0], old)
+			new = self.replace_key(path, write, 10)
+			self.assertNotEqual(new, old)
+			self.assertEqual(cache.keys()[0], new)
+			self.assertEqual(fixed.keys()[0], old)
+	# --------------------------------------------------------------------------
+
+	def test_reload_on_sighup(self):
+		self.addCleanup(signal.signal, signal.SIGHUP, signal.getsignal(signal.SIGHUP))
+		server = SSHServer(('127.0.0.1', 0), [self.ecdsa_path, self.ed25519_path], EchoCmd, CountingAuth,
+			'thread', 1, reload_keys=True)
+		server._ssock.close()
+		server._install_sighup()
+		old = server._host_keys.keys()
+		# same mtime, so only the signal can tell the cache the files changed
+		new = [self.replace_key(self.ecdsa_path, self.write_ecdsa, 0),
+			self.replace_key(self.ed25519_path, self.write_ed25519, 0)]
+		self.assertEqual(server._host_keys.keys(), old)
+		os.kill(os.getpid(), signal.SIGHUP)
+		self.assertEqual(server._host_keys.keys(), new)
+		self.assertNotEqual(new, old)
+
+
+#############################
+### TEST CASE: SSH Server ###
+#############################
+
+class TestSSHServer(ServerClient, unittest.TestCase):
+
+	key_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'key.pem')
+
+	def test_authenticator_built_once(self):
+		CountingAuth.made = CountingAuth.prepared = 0
+		server = SSHServer(('127.0.0.1', 0), self.key_path, EchoCmd, CountingAuth, 'thread', 4)
+		server._ssock.close()
+		self.assertEqual((CountingAuth.made, CountingAuth.prepared), (1, 1))
+	# --------------------------------------------------------------------------
+
+	def test_warns_when_process_mode_drops_state(self):
+		class CachingAuth(CountingAuth):
+			keeps_state = True
+		with self.assertLogs('nerfzari.network', 'WARNING'):
+			server = SSHServer(('127.0.0.1', 0), self.key_path, EchoCmd, CachingAuth, 'process', 4)
+		server._ssock.close()
+	# --------------------------------------------------------------------------
+
+	def serve(self, mode):
+		server = SSHServer(('127.0.0.1', 0), self.key_path, EchoCmd, CountingAuth, mode, 1)
+		self.port = server._ssock.getsockname()[1]
+		thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+		thread.start()
+		self.addCleanup(thread.join, 5)
+		self.addCleanup(server.shutdown)
+		return server
+
+	def wait_for_sessions(self, server, count):
+		deadline = time.monotonic() + 5
+		while server.sessions != count:
+			self.assertLess(time.monotonic(), deadline, 'sessions stuck at {}'.format(server.sessions))
+			time.sleep(0.01)
+
+	def check_waits_for_slot(self, mode):
+		server = self.serve(mode)
+		self.wait_for_sessions(server, 0) # idle prefork workers are not sessions
+		first = self.connect().invoke_shell()
+		self.read_until(first, b'>')
+		self.wait_for_sessions(server, 1)
+		second = []
+		prompted = threading.Event()
+		def second_session():
+			second.append(self.connect().invoke_shell())
+			self.read_until(second[0], b'>')
+			prompted.set()
+		thread = threading.Thread(target=second_session, daemon=True)
+		thread.start()
+		self.assertFalse(prompted.wait(0.5))
+		self.assertEqual(server.sessions, 1)
+		first.sendall(b'exit\r')
+		self.assertTrue(prompted.wait(10))
+		thread.join(5)
+		self.wait_for_sessions(server, 1)
+		second[0].sendall(b'exit\r')
+		self.wait_for_sessions(server, 0)
+	# --------------------------------------------------------------------------
+
+	def test_prefork_waits_for_slot(self):
+		self.check_waits_for_slot('prefork')
+	# --------------------------------------------------------------------------
+
+	def test_thread_waits_for_slot(self):
+		self.check_waits_for_slot('thread')
+	# --------------------------------------------------------------------------
+
+	def test_process_waits_for_slot(self):
+		self.check_waits_for_slot('process')
+
+
+
+###################################
+### TEST CASE: Async SSH Server ###
+###################################
+
+class TestAsyncSSHServer(ServerClient, unittest.TestCase):
+
+	def setUp(self):
+		# one worker, so a session that held it while idle would stall the rest
+		self.server = AsyncSSHServer(('127.0.0.1', 0), TestSSHServer.key_path, EchoCmd, CountingAuth,
+			max_sessions=4, max_workers=1)
+		self.port = self.server._ssock.getsockname()[1]
+		thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+		thread.start()
+		self.addCleanup(thread.join, 5)
+		self.addCleanup(self.server.shutdown)
+		self.client = self.connect()
+	# --------------------------------------------------------------------------
+
+	def test_shell_session(self):
+		chan = self.client.invoke_shell()
+		chan.settimeout(5)
+		# typed a key at a time, with a backspace, so the loop's line editor does the work
+		for key in [b's', b'a', b'y', b' ', b'h', b'x', b'\x7f', b'i', b'\r']:
+			chan.sendall(key)
+			time.sleep(0.01)
+		chan.sendall(b'exit\r')
+		out = b''
+		while True:
+			data = chan.recv(1024)
+			if not data:
+				break
+			out += data
+		self.assertIn(b'said hi', out)
+	# --------------------------------------------------------------------------
+
+	def test_prompt_holds_no_worker(self):
+		asking = self.client.invoke_shell()
+		asking.sendall(b'ask\r')
+		self.read_until(asking, b'name> ')
+		other = self.connect().invoke_shell()
+		other.sendall(b'say hi\r')
+		self.read_until(other, b'said hi')
+		asking.sendall(b'bob\r')
+		self.read_until(asking, b'> ')
+	# --------------------------------------------------------------------------
+
+	def test_full_window_stalls_one_session(self):
+		stalled = self.client.get_transport().open_session(window_size=32768) # the smallest paramiko allows
+		stalled.invoke_shell()
+		stalled.sendall(b'say ' + b'x' * 40000 + b'\r') # not read yet, the echo alone fills the window
+		time.sleep(0.2)
+		other = self.connect().invoke_shell()
+		other.sendall(b'say hi\r')
+		self.read_until(other, b'said hi')
+		self.read_until(stalled, b'said ' + b'x' * 40000)
+	# --------------------------------------------------------------------------
+
+	def test_exec_session(self):
+		_, out, _ = self.client.exec_command('say a\nsay b', timeout=5)
+		self.assertEqual(out.read(), b'said a\nsaid b\n')
+		self.assertEqual(out.channel.recv_exit_status(), 0)
+
+
+############
+### MAIN ###
+############
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)
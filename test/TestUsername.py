@@ -0,0 +1,47 @@
+import random
+import unittest
+from nerfzari.game.username import WordIndex, generate_username, generate_usernames
+
+#############################
+### TEST CASE: Word Index ###
+#############################
+
+class TestWordIndex(unittest.TestCase):
+
+	def setUp(self):
+		self.index = WordIndex(['giraffe', 'ox', 'cat', 'bee', 'horse'])
+	# --------------------------------------------------------------------------
+
+	def test_count(self):
+		self.assertEqual(self.index.count(), 5)
+		self.assertEqual(self.index.count(1), 0)
+		self.assertEqual(self.index.count(3), 3)
+		self.assertEqual(self.index.count(6), 4)
+		self.assertEqual(self.index.count(100), 5)
+	# --------------------------------------------------------------------------
+
+	def test_choice(self):
+		rng = random.Random(0)
+		for _ in range(50):
+			self.assertLessEqual(len(self.index.choice(3, rng)), 3)
+		self.assertRaises(ValueError, self.index.choice, 1)
+
+
+############################
+### TEST CASE: Usernames ###
+############################
+
+class TestUsernames(unittest.TestCase):
+
+	def test_length_limits(self):
+		for name in generate_usernames(100, 5, 6) + [generate_username(5, 6)]:
+			self.assertLessEqual(len(name), 11)
+			self.assertTrue(name[0].islower())
+
+
+############
+### MAIN ###
+############
+
+if __name__ == '__main__':
+	unittest.main(verbosity=2)